@@ -0,0 +1,216 @@
+"""
+Local http server used by the benchmarks
+
+Every response can be tuned with query params:
+    size        - bytes of html to return (default 10240)
+    latency     - ms to wait before responding
+    error_rate  - 0-1, chance of returning `error_code` instead
+    error_code  - status code used for errors (default 500)
+    retry_after - seconds to send in the `Retry-After` header on errors
+    redirects   - number of redirects to follow before the page is returned
+    compress    - 1 to compress the body with the best encoding the client accepts (zstd, br, gzip)
+    charset     - 0 to leave the charset out of the content-type header
+
+Paths:
+    /page   - html page with links
+    /json   - json document of about `size` bytes
+    /image  - png image, `width` & `height` params
+"""
+import io
+import gzip
+import json
+import time
+import random
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def compress_body(body, accept_encoding):
+    """
+    Return (body, content_encoding) using the best encoding in `accept_encoding` that is installed
+    """
+    accepted = [encoding.split(';')[0].strip() for encoding in accept_encoding.split(',')]
+    if zstandard is not None and 'zstd' in accepted:
+        return zstandard.ZstdCompressor().compress(body), 'zstd'
+    if brotli is not None and 'br' in accepted:
+        return brotli.compress(body), 'br'
+    if 'gzip' in accepted:
+        return gzip.compress(body, compresslevel=6), 'gzip'
+    return body, None
+
+
+def build_html(size):
+    """
+    Html page of about `size` bytes with a mix of text, links and tables
+    """
+    parts = ['<html><head><title>Benchmark page</title></head><body>']
+    i = 0
+    total = len(parts[0])
+    while total < size:
+        part = ('<div class="item" id="item-{i}"><h2>Item {i}</h2>'
+                '<a href="/page?id={i}">Link {i}</a><p>Some text for item {i} to parse</p>'
+                '<table><tr><td>{i}</td><td>{price}</td></tr></table></div>').format(i=i, price=i * 1.5)
+        parts.append(part)
+        total += len(part)
+        i += 1
+    parts.append('</body></html>')
+    return ''.join(parts).encode('utf-8')
+
+
+def build_json(size):
+    items = []
+    total = 0
+    i = 0
+    while total < size:
+        item = {'id': i, 'name': 'Item {}'.format(i), 'price': i * 1.5, 'tags': ['a', 'b', 'c']}
+        items.append(item)
+        total += len(json.dumps(item))
+        i += 1
+    return json.dumps({'items': items}).encode('utf-8')
+
+
+def build_image(width, height):
+    image_data = io.BytesIO()
+    Image.new('RGB', (width, height), color=(120, 60, 30)).save(image_data, format='PNG')
+    return image_data.getvalue()
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes, with Nagle on small bodies wait on the delayed ack
+    disable_nagle_algorithm = True
+    # Cache the generated bodies, they only depend on the params
+    _body_cache = {}
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self, path, params):
+        size = int(params.get('size', 10240))
+        if path == '/json':
+            key = ('json', size)
+            builder = (build_json, size)
+        elif path == '/image':
+            width, height = int(params.get('width', 640)), int(params.get('height', 480))
+            key = ('image', width, height)
+            builder = (build_image, width, height)
+        else:
+            key = ('html', size)
+            builder = (build_html, size)
+
+        body = self._body_cache.get(key)
+        if body is None:
+            body = self._body_cache[key] = builder[0](*builder[1:])
+        return body
+
+    def _send(self, status_code, body=b'', content_type='text/html; charset=utf-8', headers={}):
+        self.send_response(status_code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url_parts = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url_parts.query))
+
+        latency = float(params.get('latency', 0))
+        if latency > 0:
+            time.sleep(latency / 1000)
+
+        redirects = int(params.get('redirects', 0))
+        if redirects > 0:
+            params['redirects'] = redirects - 1
+            location = '{}?{}'.format(url_parts.path, urllib.parse.urlencode(params))
+            self._send(302, headers={'Location': location})
+            return
+
+        if random.random() < float(params.get('error_rate', 0)):
+            headers = {}
+            if 'retry_after' in params:
+                headers['Retry-After'] = params['retry_after']
+            self._send(int(params.get('error_code', 500)), b'error', headers=headers)
+            return
+
+        body = self._body(url_parts.path, params)
+        if url_parts.path == '/json':
+            content_type = 'application/json'
+        elif url_parts.path == '/image':
+            content_type = 'image/png'
+        else:
+            content_type = 'text/html; charset=utf-8'
+        if params.get('charset') == '0':
+            content_type = content_type.split(';')[0]
+
+        headers = {}
+        if params.get('compress') == '1':
+            key = ('compressed', url_parts.path, params.get('size'), self.headers.get('Accept-Encoding', ''))
+            compressed = self._body_cache.get(key)
+            if compressed is None:
+                compressed = self._body_cache[key] = compress_body(body, self.headers.get('Accept-Encoding', ''))
+            body, content_encoding = compressed
+            if content_encoding is not None:
+                headers['Content-Encoding'] = content_encoding
+        self._send(200, body, content_type=content_type, headers=headers)
+
+
+class FixtureServer:
+    """
+    Run the fixture server in a background thread
+
+        with FixtureServer() as server:
+            server.url('/page', size=1024)
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.httpd = ThreadingHTTPServer((host, port), FixtureHandler)
+        self.httpd.daemon_threads = True
+        self.host, self.port = self.httpd.server_address[:2]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def url(self, path='/page', **params):
+        query = ''
+        if params:
+            query = '?' + urllib.parse.urlencode(params)
+        return 'http://{}:{}{}{}'.format(self.host, self.port, path, query)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Run the benchmark fixture server")
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+
+    server = FixtureServer(port=args.port)
+    print("Serving on {}".format(server.url('/')))
+    server.httpd.serve_forever()
@@ -0,0 +1,190 @@
+"""
+Local HTTP/2 server used by the benchmarks, needs the `h2` package
+
+Speaks HTTP/2 with prior knowledge (h2c) over plain tcp, so clients have to be set to
+HTTP/2 only (`Http2ClientPool(http1=False)`). Streams on a connection are answered
+concurrently, so `latency` does not block the other streams.
+
+Paths and params are the same as FixtureServer (size, latency, error_rate, error_code, redirects)
+"""
+import time
+import random
+import socket
+import threading
+import urllib.parse
+from benchmarks.fixture_server import build_html, build_json
+
+try:
+    import h2.config
+    import h2.events
+    import h2.settings
+    import h2.connection
+    import h2.exceptions
+except ImportError:
+    h2 = None
+
+
+class _H2Connection:
+    """
+    A single client connection, frames are read in one thread and each stream is answered in its own
+    """
+
+    def __init__(self, server, sock):
+        self.server = server
+        self.sock = sock
+        self.conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False,
+                                                                               header_encoding='utf-8'))
+        # Held while using the h2 state machine and writing to the socket
+        self.lock = threading.Lock()
+        # Notified when the client opens up the flow control window
+        self.window_open = threading.Condition(self.lock)
+        self.closed = False
+
+    def _flush(self):
+        data = self.conn.data_to_send()
+        if data:
+            self.sock.sendall(data)
+
+    def serve(self):
+        with self.lock:
+            self.conn.initiate_connection()
+            self.conn.update_settings({h2.settings.SettingCodes.MAX_CONCURRENT_STREAMS:
+                                       self.server.max_concurrent_streams})
+            self._flush()
+
+        try:
+            while True:
+                data = self.sock.recv(65535)
+                if not data:
+                    break
+                with self.lock:
+                    events = self.conn.receive_data(data)
+                    self._flush()
+                    for event in events:
+                        if isinstance(event, h2.events.RequestReceived):
+                            threading.Thread(target=self._respond, args=(event.stream_id, dict(event.headers)),
+                                             daemon=True).start()
+                        elif isinstance(event, (h2.events.WindowUpdated, h2.events.StreamReset)):
+                            self.window_open.notify_all()
+                        elif isinstance(event, h2.events.ConnectionTerminated):
+                            return
+        except (OSError, h2.exceptions.ProtocolError):
+            pass
+        finally:
+            with self.lock:
+                self.closed = True
+                self.window_open.notify_all()
+            self.sock.close()
+
+    def _respond(self, stream_id, headers):
+        url_parts = urllib.parse.urlsplit(headers.get(':path', '/'))
+        params = dict(urllib.parse.parse_qsl(url_parts.query))
+
+        latency = float(params.get('latency', 0))
+        if latency > 0:
+            time.sleep(latency / 1000)
+
+        response_headers = []
+        redirects = int(params.get('redirects', 0))
+        if redirects > 0:
+            params['redirects'] = redirects - 1
+            status_code, body, content_type = 302, b'', 'text/html'
+            response_headers.append(('location', '{}?{}'.format(url_parts.path, urllib.parse.urlencode(params))))
+        elif random.random() < float(params.get('error_rate', 0)):
+            status_code, body, content_type = int(params.get('error_code', 500)), b'error', 'text/html'
+        elif url_parts.path == '/json':
+            status_code, body, content_type = 200, self.server.body('json', int(params.get('size', 10240))), \
+                'application/json'
+        else:
+            status_code, body, content_type = 200, self.server.body('html', int(params.get('size', 10240))), \
+                'text/html; charset=utf-8'
+
+        response_headers = [(':status', str(status_code)),
+                            ('content-type', content_type),
+                            ('content-length', str(len(body))),
+                            ] + response_headers
+        try:
+            with self.lock:
+                self.conn.send_headers(stream_id, response_headers, end_stream=not body)
+                self._flush()
+
+                sent = 0
+                while sent < len(body):
+                    window = min(self.conn.local_flow_control_window(stream_id), self.conn.max_outbound_frame_size)
+                    if window <= 0:
+                        if self.closed:
+                            return
+                        self.window_open.wait(timeout=5)
+                        continue
+                    chunk = body[sent:sent + window]
+                    sent += len(chunk)
+                    self.conn.send_data(stream_id, chunk, end_stream=sent >= len(body))
+                    self._flush()
+        except (OSError, h2.exceptions.StreamClosedError, h2.exceptions.ProtocolError):
+            # The client went away or reset the stream
+            pass
+
+
+class H2FixtureServer:
+    """
+    Run the HTTP/2 fixture server in a background thread
+
+        with H2FixtureServer() as server:
+            server.url('/page', latency=50)
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, max_concurrent_streams=100):
+        if h2 is None:
+            raise ImportError("The HTTP/2 fixture server needs h2, install it with `pip install h2`")
+
+        self.max_concurrent_streams = max_concurrent_streams
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(128)
+        self.host, self.port = self.sock.getsockname()[:2]
+        self.connections = 0
+        self._body_cache = {}
+        self._thread = None
+
+    def body(self, body_type, size):
+        key = (body_type, size)
+        body = self._body_cache.get(key)
+        if body is None:
+            body = self._body_cache[key] = build_json(size) if body_type == 'json' else build_html(size)
+        return body
+
+    def _accept(self):
+        while True:
+            try:
+                client_sock, _ = self.sock.accept()
+            except OSError:
+                # Server was stopped
+                return
+            client_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.connections += 1
+            threading.Thread(target=_H2Connection(self, client_sock).serve, daemon=True).start()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+    def url(self, path='/page', **params):
+        query = ''
+        if params:
+            query = '?' + urllib.parse.urlencode(params)
+        return 'http://{}:{}{}{}'.format(self.host, self.port, path, query)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
@@ -0,0 +1,98 @@
+"""
+Peak memory of a long lived worker fetching 1,000 pages
+
+Each variant runs in its own process so the peak RSS numbers do not bleed into each other.
+A worker holds `drivers` DriverRequests instances (like a pool of sessions) and fetches
+`pages` pages round robin, keeping only the title it extracts from each page.
+
+    python -m benchmarks.memory_benchmark -n 1000 --size 50
+"""
+import sys
+import json
+import argparse
+import resource
+import subprocess
+
+VARIANTS = {
+    # How the library behaves by default
+    'default': {'web': {}, 'lean': False},
+    # Only drop the response objects
+    'no_response': {'web': {'retain_response': False}, 'lean': False},
+    # Drop the responses, extract in a parse_callback and decompose the soup after
+    'lean': {'web': {'retain_response': False, 'decompose_soup': True}, 'lean': True},
+}
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    if sys.platform == 'darwin':
+        return peak / 1024 / 1024
+    return peak / 1024
+
+
+def get_title(soup):
+    return soup.title.get_text() if soup.title else None
+
+
+def run_variant(name, url, pages, drivers):
+    from web_wrapper import DriverRequests
+
+    options = VARIANTS[name]
+    webs = [DriverRequests(**options['web']) for _ in range(drivers)]
+    # Imports and empty drivers are not part of the number, what the drivers hold on to is
+    start_rss = peak_rss_mb()
+
+    titles = []
+    for i in range(pages):
+        web = webs[i % drivers]
+        if options['lean'] is True:
+            result = web.get_site(url, parse_callback=get_title, return_result=True)
+            titles.append(result.body)
+            result.release()
+        else:
+            titles.append(get_title(web.get_site(url)))
+
+    return {'variant': name,
+            'pages': pages,
+            'start_rss_mb': start_rss,
+            'peak_rss_mb': peak_rss_mb(),
+            'rss_growth_mb': peak_rss_mb() - start_rss,
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak memory of get_site over 1,000 pages")
+    parser.add_argument('-n', '--pages', type=int, default=1000)
+    parser.add_argument('-d', '--drivers', type=int, default=20, help="Driver instances held by the worker")
+    parser.add_argument('--size', type=int, default=50, help="Page size in KB")
+    parser.add_argument('-o', '--output', help="Save the results to this json file")
+    parser.add_argument('--variant', choices=VARIANTS.keys(), help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant is not None:
+        # Child process, run a single variant
+        print(json.dumps(run_variant(args.variant, args.url, args.pages, args.drivers)))
+        return
+
+    from benchmarks.fixture_server import FixtureServer
+
+    results = {}
+    with FixtureServer() as server:
+        url = server.url('/page', size=args.size * 1024)
+        for name in VARIANTS:
+            output = subprocess.run([sys.executable, '-m', 'benchmarks.memory_benchmark', '--variant', name,
+                                     '--url', url, '-n', str(args.pages), '-d', str(args.drivers)],
+                                    check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+            result = results[name] = json.loads(output.strip().splitlines()[-1])
+            print("{:<15} peak {:>8.1f}MB  +{:>7.1f}MB over {:,} pages"
+                  .format(name, result['peak_rss_mb'], result['rss_growth_mb'], args.pages))
+
+    if args.output:
+        with open(args.output, 'w') as out_file:
+            json.dump(results, out_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""
+Benchmarks for the web_wrapper drivers
+
+Run from the root of the repo:
+    python -m benchmarks.run_benchmarks --output results.json
+    python -m benchmarks.run_benchmarks --baseline results.json
+
+Results are saved as json so runs can be compared against a baseline.
+Selenium scenarios only run with `--selenium` and a local chrome/chromedriver.
+HTTP/2 scenarios only run with `--http2` and need `httpx[http2]`.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.fixture_server import FixtureServer
+from web_wrapper import DriverRequests
+
+logger = logging.getLogger(__name__)
+
+
+def summarize(durations, wall_time):
+    ordered = sorted(durations)
+
+    def percentile(percent):
+        return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+    return {'count': len(ordered),
+            'wall_time': wall_time,
+            'throughput': len(ordered) / wall_time if wall_time else 0,
+            'mean': statistics.mean(ordered),
+            'p50': percentile(50),
+            'p95': percentile(95),
+            'max': ordered[-1],
+            }
+
+
+def run_scenario(name, func, iterations, concurrency=1):
+    """
+    Call `func(i)` `iterations` times spread over `concurrency` threads and time each call
+    """
+    def timed(i):
+        start = time.perf_counter()
+        func(i)
+        return time.perf_counter() - start
+
+    # Warm up, so connection setup is not part of the numbers
+    func(0)
+
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            durations = list(executor.map(timed, range(iterations)))
+    else:
+        durations = [timed(i) for i in range(iterations)]
+    wall_time = time.perf_counter() - start
+
+    result = summarize(durations, wall_time)
+    print("{:<45} {:>8.1f} req/s  p50 {:>7.2f}ms  p95 {:>7.2f}ms"
+          .format(name, result['throughput'], result['p50'] * 1000, result['p95'] * 1000))
+    return result
+
+
+def driver_scenarios(server, web, iterations, concurrency, prefix):
+    results = {}
+    for size in (10 * 1024, 200 * 1024):
+        url = server.url('/page', size=size)
+        for page_format, parser in (('raw', None), ('html', 'beautifulsoup'), ('html', 'parsel')):
+            name = '{}.get_site.{}.{}.{}k'.format(prefix, page_format, parser or 'none', size // 1024)
+            results[name] = run_scenario(name,
+                                         lambda i: web.get_site(url, page_format=page_format, parser=parser),
+                                         iterations, concurrency)
+
+    url = server.url('/json', size=50 * 1024)
+    name = '{}.get_site.json.50k'.format(prefix)
+    results[name] = run_scenario(name, lambda i: web.get_site(url, page_format='json'), iterations, concurrency)
+
+    url = server.url('/page', size=10 * 1024, latency=20)
+    name = '{}.get_site.raw.latency_20ms'.format(prefix)
+    results[name] = run_scenario(name, lambda i: web.get_site(url, page_format='raw'), iterations, concurrency)
+
+    url = server.url('/page', size=10 * 1024, redirects=3)
+    name = '{}.get_site.raw.redirects_3'.format(prefix)
+    results[name] = run_scenario(name, lambda i: web.get_site(url, page_format='raw'), iterations, concurrency)
+
+    return results
+
+
+def requests_scenarios(server, iterations, concurrency):
+    web = DriverRequests()
+    results = driver_scenarios(server, web, iterations, concurrency, 'requests')
+
+    # Retry overhead, every request fails so each call burns all of its retries
+    url = server.url('/page', error_rate=1, error_code=503, retry_after=1)
+    name = 'requests.get_site.retry_503'
+    results[name] = run_scenario(name, lambda i: web.get_site(url, page_format='raw'), max(1, iterations // 50))
+
+    # Compressed body, and a page with no charset so it has to be sniffed from the body
+    url = server.url('/page', size=200 * 1024, compress=1)
+    name = 'requests.get_site.raw.compressed_200k'
+    results[name] = run_scenario(name, lambda i: web.get_site(url, page_format='raw'), iterations, concurrency)
+    results[name]['transfer'] = dict(web.transfer)
+    print("{:<45} {} wire bytes, {} decoded ({})".format('', web.transfer['wire_bytes'],
+                                                       web.transfer['decoded_bytes'],
+                                                       web.transfer['content_encoding']))
+
+    url = server.url('/page', size=200 * 1024, charset=0)
+    name = 'requests.get_site.raw.no_charset_200k'
+    results[name] = run_scenario(name, lambda i: web.get_site(url, page_format='raw'), iterations, concurrency)
+
+    url = server.url('/image', width=800, height=600)
+    name = 'requests.get_image_dimension'
+    results[name] = run_scenario(name, lambda i: web.get_image_dimension(url), iterations, concurrency)
+
+    url = server.url('/page', size=100 * 1024)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        name = 'requests.download.100k'
+        results[name] = run_scenario(name,
+                                     lambda i: web.download(url, os.path.join(tmp_dir, '{}.html'.format(i)),
+                                                            redownload=True),
+                                     iterations, concurrency)
+
+    web.quit()
+    return results
+
+
+def selenium_scenarios(server, iterations):
+    try:
+        from web_wrapper import DriverSeleniumChrome
+        web = DriverSeleniumChrome()
+    except Exception:
+        logger.exception("Could not start a local browser, skipping selenium benchmarks")
+        return {}
+
+    try:
+        return driver_scenarios(server, web, iterations, 1, 'selenium_chrome')
+    finally:
+        web.quit()
+
+
+def http2_scenarios(server, iterations, concurrency):
+    """
+    Many concurrent requests to a single slow host, HTTP/1.1 with a connection pool vs HTTP/2 streams
+    Every thread gets its own driver, like a Pipeline does
+    """
+    try:
+        from web_wrapper import DriverHttp2, Http2ClientPool
+        from benchmarks.h2_fixture_server import H2FixtureServer
+        client_pool = Http2ClientPool(http1=False)
+    except ImportError:
+        logger.exception("httpx[http2] is not installed, skipping http2 benchmarks")
+        return {}
+
+    def per_thread(web_factory):
+        local = threading.local()
+
+        def get_web():
+            if not hasattr(local, 'web'):
+                local.web = web_factory()
+            return local.web
+        return get_web
+
+    results = {}
+    requests_web = per_thread(DriverRequests)
+    url = server.url('/page', size=2 * 1024, latency=50)
+    name = 'requests.fanout.c{}.latency_50ms'.format(concurrency)
+    results[name] = run_scenario(name, lambda i: requests_web().get_site(url, page_format='raw'),
+                                 iterations, concurrency)
+
+    with H2FixtureServer() as h2_server:
+        http2_web = per_thread(lambda: DriverHttp2(client_pool=client_pool))
+        url = h2_server.url('/page', size=2 * 1024, latency=50)
+        name = 'http2.fanout.c{}.latency_50ms'.format(concurrency)
+        results[name] = run_scenario(name, lambda i: http2_web().get_site(url, page_format='raw'),
+                                     iterations, concurrency)
+        for host, streams in client_pool.stats().get(None, {}).items():
+            print("{:<45} {} connection(s), peak {} concurrent streams"
+                  .format('', streams.get('connections'), streams['peak_in_flight']))
+
+    client_pool.close()
+    return results
+
+
+def compare(results, baseline):
+    """
+    Print the change in throughput and p50 against a baseline run
+    """
+    print("\n{:<45} {:>12} {:>12}".format('Scenario', 'throughput', 'p50'))
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        throughput_change = (result['throughput'] - base['throughput']) / base['throughput'] * 100
+        p50_change = (result['p50'] - base['p50']) / base['p50'] * 100
+        print("{:<45} {:>+11.1f}% {:>+11.1f}%".format(name, throughput_change, p50_change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the web_wrapper drivers against a local server")
+    parser.add_argument('-n', '--iterations', type=int, default=200)
+    parser.add_argument('-c', '--concurrency', type=int, default=1)
+    parser.add_argument('-o', '--output', help="Save the results to this json file")
+    parser.add_argument('-b', '--baseline', help="Compare the results to this json file")
+    parser.add_argument('--selenium', action='store_true', help="Also run the selenium benchmarks")
+    parser.add_argument('--http2', action='store_true', help="Also run the HTTP/2 fan out benchmarks")
+    args = parser.parse_args()
+
+    # The retry scenarios log on every failure
+    logging.basicConfig(level=logging.CRITICAL)
+
+    with FixtureServer() as server:
+        results = requests_scenarios(server, args.iterations, args.concurrency)
+        if args.selenium is True:
+            results.update(selenium_scenarios(server, max(1, args.iterations // 10)))
+        if args.http2 is True:
+            results.update(http2_scenarios(server, args.iterations, max(args.concurrency, 50)))
+
+    if args.output is not None:
+        with open(args.output, 'w') as out_file:
+            json.dump({'python': sys.version,
+                       'platform': platform.platform(),
+                       'iterations': args.iterations,
+                       'concurrency': args.concurrency,
+                       'results': results,
+                       }, out_file, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as in_file:
+            compare(results, json.load(in_file)['results'])
+
+
+if __name__ == '__main__':
+    main()
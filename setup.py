@@ -22,6 +22,7 @@ setup(
     install_requires=[
         'bs4',
         'cutil',
+        'lxml',
         'parsel',
         'pillow',
         'requests',
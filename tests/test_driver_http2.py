@@ -0,0 +1,48 @@
+import pytest
+
+pytest.importorskip('httpx')
+pytest.importorskip('h2')
+
+from web_wrapper import DriverHttp2, Http2ClientPool  # noqa: E402
+from benchmarks.h2_fixture_server import H2FixtureServer  # noqa: E402
+
+
+@pytest.fixture
+def server():
+    with H2FixtureServer() as server:
+        yield server
+
+
+@pytest.fixture
+def client_pool():
+    # The fixture server only speaks HTTP/2 with prior knowledge
+    client_pool = Http2ClientPool(http1=False)
+    yield client_pool
+    client_pool.close()
+
+
+def test_get_site_uses_http2(server, client_pool):
+    web = DriverHttp2(client_pool=client_pool)
+    source = web.get_site(server.url('/page', size=1024), page_format='raw')
+
+    assert web.status_code == 200
+    assert len(source) > 0
+    assert web.transfer['http_version'] == 'HTTP/2'
+
+
+def test_requests_share_one_connection(server, client_pool):
+    urls = [server.url('/page', latency=50, id=i) for i in range(20)]
+    web = DriverHttp2(client_pool=client_pool)
+    results = list(web.stream(urls, workers=10, web_factory=lambda: DriverHttp2(client_pool=client_pool),
+                              page_format='raw'))
+
+    assert len(results) == len(urls)
+    assert all(result.error is None and result.status_code == 200 for result in results)
+    # Every stream was multiplexed over a single connection
+    assert server.connections == 1
+
+    host_stats = client_pool.stats()[None]['{}:{}'.format(server.host, server.port)]
+    assert host_stats['requests'] == len(urls)
+    assert host_stats['http_versions'] == {'HTTP/2': len(urls)}
+    assert host_stats['connections'] == 1
+    assert host_stats['peak_in_flight'] > 1
@@ -1,3 +1,19 @@
 from web_wrapper.driver_requests import DriverRequests
 from web_wrapper.driver_selenium_chrome import DriverSeleniumChrome
 from web_wrapper.driver_selenium_phantomjs import DriverSeleniumPhantomJS
+from web_wrapper.driver_hybrid import DriverHybrid
+from web_wrapper.driver_http2 import DriverHttp2, Http2ClientPool
+from web_wrapper.proxy_pool import ProxyPool
+from web_wrapper.circuit_breaker import CircuitBreaker, CircuitOpenError, shared_circuit_breaker
+from web_wrapper.request_coalescer import RequestCoalescer
+from web_wrapper.metrics import MetricsRegistry
+from web_wrapper.profiler import Profiler
+from web_wrapper.archive import RequestArchive, ArchiveMissError
+from web_wrapper.extractor import Field, Schema
+from web_wrapper.parse_pool import ParsePool
+from web_wrapper.crawler import Crawler, Frontier, BloomFilter, canonicalize_url
+from web_wrapper.pipeline import Pipeline, PipelineResult
+from web_wrapper.robots import RobotsCache, RobotsDisallowedError
+from web_wrapper.process_runner import ProcessRunner, HostRateLimiter
+from web_wrapper.dns_cache import DNSCache
+from web_wrapper.result import SiteResult
@@ -0,0 +1,153 @@
+import json
+import time
+import zlib
+import sqlite3
+import logging
+import threading
+import requests
+
+logger = logging.getLogger(__name__)
+
+RECORD = 'record'
+REPLAY = 'replay'
+
+
+class ArchiveMissError(IOError):
+    """
+    Raised in replay mode when the url was never recorded
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args)
+        self.url = kwargs.get('url')
+
+
+class RequestArchive:
+    """
+    On disk archive of requests and responses, used to record live runs and replay them offline
+
+    In `record` mode every get_site, download and get_image_dimension request is saved.
+    In `replay` mode those calls are served from the archive and never touch the network.
+
+    Stored in a single sqlite file indexed by url, bodies are zlib compressed
+    `latency` in replay mode can be None (no delay), 'recorded' (wait as long as the
+    original request took) or a number of seconds to wait
+    """
+
+    def __init__(self, path, mode=REPLAY, latency=None, compress_level=6):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError("mode must be `{}` or `{}`".format(RECORD, REPLAY))
+
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.compress_level = compress_level
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                id INTEGER PRIMARY KEY,
+                                url TEXT NOT NULL,
+                                final_url TEXT,
+                                status_code INTEGER,
+                                request_headers TEXT,
+                                headers TEXT,
+                                encoding TEXT,
+                                elapsed REAL,
+                                recorded_at REAL,
+                                body BLOB
+                            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_url ON responses (url)")
+        self._db.commit()
+
+    @property
+    def is_recording(self):
+        return self.mode == RECORD
+
+    @property
+    def is_replaying(self):
+        return self.mode == REPLAY
+
+    def record(self, url, status_code, body, headers={}, request_headers={}, final_url=None,
+               encoding=None, elapsed=None):
+        """
+        Save a response, `body` is bytes or str
+        """
+        if isinstance(body, str):
+            encoding = encoding or 'utf-8'
+            body = body.encode(encoding)
+
+        with self._lock:
+            self._db.execute("INSERT INTO responses (url, final_url, status_code, request_headers, headers,"
+                             " encoding, elapsed, recorded_at, body) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             (url,
+                              final_url or url,
+                              status_code,
+                              json.dumps(dict(request_headers or {})),
+                              json.dumps(dict(headers or {})),
+                              encoding,
+                              elapsed,
+                              time.time(),
+                              zlib.compress(body or b'', self.compress_level),
+                              ))
+            self._db.commit()
+
+    def lookup(self, url):
+        """
+        Return the latest record for the url as a dict, or None if it was never recorded
+        """
+        with self._lock:
+            row = self._db.execute("SELECT url, final_url, status_code, request_headers, headers, encoding,"
+                                   " elapsed, body FROM responses WHERE url = ? ORDER BY id DESC LIMIT 1",
+                                   (url,)).fetchone()
+        if row is None:
+            return None
+
+        record = {'url': row[0],
+                  'final_url': row[1],
+                  'status_code': row[2],
+                  'request_headers': json.loads(row[3]),
+                  'headers': json.loads(row[4]),
+                  'encoding': row[5],
+                  'elapsed': row[6],
+                  'body': zlib.decompress(row[7]),
+                  }
+
+        self._simulate_latency(record)
+        return record
+
+    def get_response(self, url):
+        """
+        Return the record as a requests.Response, or None if it was never recorded
+        """
+        record = self.lookup(url)
+        if record is None:
+            return None
+
+        response = requests.Response()
+        response.url = record['final_url']
+        response.status_code = record['status_code']
+        response.headers.update(record['headers'])
+        response.encoding = record['encoding']
+        response._content = record['body']
+        return response
+
+    def _simulate_latency(self, record):
+        if self.latency is None:
+            return
+        if self.latency == 'recorded':
+            time.sleep(record['elapsed'] or 0)
+        else:
+            time.sleep(self.latency)
+
+    def urls(self):
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT DISTINCT url FROM responses")]
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,133 @@
+import time
+import logging
+import threading
+import urllib.parse
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(IOError):
+    """
+    Raised by get_site when the host is failing and requests to it are being skipped
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args)
+        self.host = kwargs.get('host')
+
+
+class CircuitBreaker:
+    """
+    Per host circuit breaker
+    After `failure_threshold` failures in a row the circuit opens and every request to that
+    host fails fast. Once `recovery_timeout` seconds pass, up to `half_open_max_calls` probe
+    requests are let through. A successful probe closes the circuit, a failed one opens it again.
+    Probes that never report back are given up on after `probe_timeout` seconds (defaults to
+    `recovery_timeout`) so new probes can go out.
+
+    Thread safe so a single instance can be shared between every driver in the process
+    """
+
+    def __init__(self, failure_threshold=5, recovery_timeout=30, half_open_max_calls=1, probe_timeout=None):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.probe_timeout = recovery_timeout if probe_timeout is None else probe_timeout
+
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    @staticmethod
+    def get_host(url):
+        return urllib.parse.urlsplit(url).netloc.lower()
+
+    def _get_circuit(self, host):
+        circuit = self._hosts.get(host)
+        if circuit is None:
+            circuit = self._hosts[host] = {'state': CLOSED,
+                                           'failures': 0,
+                                           'opened_at': 0,
+                                           'probes': 0,
+                                           'probe_at': 0,
+                                           }
+        return circuit
+
+    def allow_request(self, url):
+        """
+        Return True if a request to the host of `url` can be made
+        """
+        host = self.get_host(url)
+        with self._lock:
+            circuit = self._get_circuit(host)
+
+            if circuit['state'] == OPEN:
+                if time.time() - circuit['opened_at'] < self.recovery_timeout:
+                    return False
+                logger.info("Circuit half open for {}".format(host))
+                circuit['state'] = HALF_OPEN
+                circuit['probes'] = 0
+
+            if circuit['state'] == HALF_OPEN:
+                if circuit['probes'] >= self.half_open_max_calls:
+                    if time.time() - circuit['probe_at'] < self.probe_timeout:
+                        return False
+                    logger.info("Half open probe for {} timed out".format(host))
+                    circuit['probes'] = 0
+                circuit['probes'] += 1
+                circuit['probe_at'] = time.time()
+
+            return True
+
+    def record_success(self, url):
+        host = self.get_host(url)
+        with self._lock:
+            circuit = self._get_circuit(host)
+            if circuit['state'] != CLOSED:
+                logger.info("Circuit closed for {}".format(host))
+            circuit['state'] = CLOSED
+            circuit['failures'] = 0
+            circuit['probes'] = 0
+
+    def record_failure(self, url):
+        host = self.get_host(url)
+        with self._lock:
+            circuit = self._get_circuit(host)
+            circuit['failures'] += 1
+            if circuit['state'] == HALF_OPEN or circuit['failures'] >= self.failure_threshold:
+                if circuit['state'] != OPEN:
+                    logger.warning("Circuit open for {} after {} failures".format(host, circuit['failures']))
+                circuit['state'] = OPEN
+                circuit['opened_at'] = time.time()
+
+    def release(self, url):
+        """
+        Give back a half open probe slot for a request that ended without a result
+        """
+        host = self.get_host(url)
+        with self._lock:
+            circuit = self._get_circuit(host)
+            if circuit['state'] == HALF_OPEN and circuit['probes'] > 0:
+                circuit['probes'] -= 1
+
+    def state(self, url):
+        host = self.get_host(url)
+        with self._lock:
+            return self._get_circuit(host)['state']
+
+    def reset(self, url=None):
+        """
+        Close the circuit for a single host, or every host if no url is passed in
+        """
+        with self._lock:
+            if url is None:
+                self._hosts = {}
+            else:
+                self._hosts.pop(self.get_host(url), None)
+
+
+# Pass this into the drivers to share circuit state across every driver in the process
+shared_circuit_breaker = CircuitBreaker()
@@ -0,0 +1,431 @@
+import os
+import json
+import math
+import time
+import heapq
+import base64
+import hashlib
+import logging
+import threading
+import urllib.parse
+from parsel import Selector
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def canonicalize_url(url):
+    """
+    Normalize a url so the same page is only crawled once
+    Lowercase scheme & host, drop default ports and fragments,
+    sort the query params and resolve `.`/`..` in the path
+    """
+    parts = urllib.parse.urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+
+    if ':' in host:
+        # IPv6, hostname strips the brackets
+        host = '[{}]'.format(host)
+
+    netloc = host
+    if parts.port is not None and DEFAULT_PORTS.get(scheme) != parts.port:
+        netloc = '{}:{}'.format(host, parts.port)
+    userinfo = parts.netloc.rpartition('@')[0]
+    if userinfo:
+        netloc = '{}@{}'.format(userinfo, netloc)
+
+    segments = []
+    for segment in parts.path.split('/'):
+        if segment == '..':
+            if len(segments) > 1:
+                segments.pop()
+        elif segment != '.':
+            segments.append(segment)
+    path = '/'.join(segments) or '/'
+    if not path.startswith('/'):
+        path = '/' + path
+
+    query = urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(parts.query, keep_blank_values=True)))
+    return urllib.parse.urlunsplit((scheme, netloc, path, query, ''))
+
+
+class BloomFilter:
+    """
+    Fixed memory set of seen urls, can give false positives (skip a url it never saw)
+    at about `error_rate` once `capacity` items have been added
+    """
+
+    def __init__(self, capacity=10000000, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        # Double hashing, two 64bit hashes give all k positions
+        hash_1 = int.from_bytes(digest[:8], 'little')
+        hash_2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(hash_1 + i * hash_2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item):
+        """
+        Add the item, returns False if it was (probably) already in the set
+        """
+        added = False
+        for position in self._positions(item):
+            byte_index, bit = divmod(position, 8)
+            if not self.bits[byte_index] & (1 << bit):
+                self.bits[byte_index] |= 1 << bit
+                added = True
+        if added is True:
+            self.count += 1
+        return added
+
+    def __contains__(self, item):
+        for position in self._positions(item):
+            byte_index, bit = divmod(position, 8)
+            if not self.bits[byte_index] & (1 << bit):
+                return False
+        return True
+
+    def __len__(self):
+        return self.count
+
+    def copy(self):
+        bloom = BloomFilter.__new__(BloomFilter)
+        bloom.__dict__.update(self.__dict__)
+        bloom.bits = bytearray(self.bits)
+        return bloom
+
+    def to_dict(self):
+        return {'capacity': self.capacity,
+                'error_rate': self.error_rate,
+                'count': self.count,
+                'bits': base64.b64encode(bytes(self.bits)).decode('ascii'),
+                }
+
+    @classmethod
+    def from_dict(cls, data):
+        bloom = cls(capacity=data['capacity'], error_rate=data['error_rate'])
+        bloom.bits = bytearray(base64.b64decode(data['bits']))
+        bloom.count = data['count']
+        return bloom
+
+
+class Frontier:
+    """
+    Urls waiting to be crawled
+    Each host has its own priority queue (lower priority is crawled first), and hosts
+    take turns so a single host can not take over the crawl. A host is not handed out
+    again until `host_delay` seconds after its last url.
+    """
+
+    def __init__(self, host_delay=0):
+        self.host_delay = host_delay
+
+        self._lock = threading.Condition()
+        self._seq = 0
+        # host -> heap of (priority, seq, url, depth)
+        self._queues = {}
+        # heap of (next allowed time, host) for hosts that have urls
+        self._hosts = []
+        # host -> time its last url was handed out, for hosts that have no urls right now
+        self._last_pop = {}
+        self._size = 0
+
+    def push(self, url, depth=0, priority=0):
+        host = urllib.parse.urlsplit(url).netloc
+        with self._lock:
+            queue = self._queues.get(host)
+            if not queue:
+                queue = self._queues[host] = []
+                # Still wait out the delay if the host ran out of urls a moment ago
+                heapq.heappush(self._hosts, (self._last_pop.pop(host, 0) + self.host_delay, host))
+            self._seq += 1
+            heapq.heappush(queue, (priority, self._seq, url, depth))
+            self._size += 1
+            self._lock.notify()
+
+    def pop(self, timeout=None):
+        """
+        Return (url, depth) of the next url to crawl, None if nothing was ready within `timeout`
+        """
+        end_time = None if timeout is None else time.time() + timeout
+        with self._lock:
+            while True:
+                now = time.time()
+                if self._hosts and self._hosts[0][0] <= now:
+                    _, host = heapq.heappop(self._hosts)
+                    queue = self._queues[host]
+                    _, _, url, depth = heapq.heappop(queue)
+                    self._size -= 1
+                    if queue:
+                        heapq.heappush(self._hosts, (now + self.host_delay, host))
+                    else:
+                        del self._queues[host]
+                        if self.host_delay > 0:
+                            self._remember_pop(host, now)
+                    return url, depth
+
+                wait = None
+                if self._hosts:
+                    wait = self._hosts[0][0] - now
+                if end_time is not None:
+                    remaining = end_time - now
+                    if remaining <= 0:
+                        return None
+                    wait = remaining if wait is None else min(wait, remaining)
+                self._lock.wait(wait)
+
+    def _remember_pop(self, host, now):
+        self._last_pop[host] = now
+        if len(self._last_pop) > 10000:
+            # Drop hosts whose delay is already over
+            self._last_pop = {host: pop_time for host, pop_time in self._last_pop.items()
+                              if pop_time + self.host_delay > now}
+
+    def __len__(self):
+        return self._size
+
+    def to_list(self):
+        with self._lock:
+            return [[url, depth, priority] for queue in self._queues.values()
+                    for priority, _, url, depth in queue]
+
+
+class Crawler:
+    """
+    Crawl sites using get_site
+
+        crawler = Crawler(lambda: DriverRequests(), ['http://example.com'], max_depth=2,
+                          on_page=save_page, checkpoint_path='crawl.json')
+        crawler.run()
+
+    `web_factory` is called once per worker thread to get its own driver
+    `on_page(web, url, page, depth)` is called with each parsed page, if it returns a list of
+    urls those are crawled instead of every link found on the page
+    Seen urls are kept in a bloom filter so memory use stays flat. With `checkpoint_path` set
+    the crawl state is saved every `checkpoint_every` pages and loaded again on start.
+    With a `dns_cache` (the same one the drivers use) hosts are resolved as urls are queued.
+    """
+
+    def __init__(self, web_factory, seeds=[], workers=4, max_depth=None, max_pages=None, max_pages_per_host=None,
+                 allowed_hosts=None, link_filter=None, on_page=None, parser='parsel', host_delay=0,
+                 seen_capacity=10000000, seen_error_rate=0.001, checkpoint_path=None, checkpoint_every=1000,
+                 get_site_kwargs={}, dns_cache=None):
+        self.web_factory = web_factory
+        self.workers = workers
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.max_pages_per_host = max_pages_per_host
+        self.allowed_hosts = set(allowed_hosts) if allowed_hosts is not None else None
+        self.link_filter = link_filter
+        self.on_page = on_page
+        self.parser = parser
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        self.get_site_kwargs = get_site_kwargs
+        self.dns_cache = dns_cache
+
+        self.frontier = Frontier(host_delay=host_delay)
+        self.seen = BloomFilter(capacity=seen_capacity, error_rate=seen_error_rate)
+        self.stats = {'crawled': 0, 'failed': 0, 'queued': 0}
+        self.host_counts = {}
+
+        self._lock = threading.Lock()
+        # url -> depth of the urls being crawled right now
+        self._in_flight = {}
+        # Urls queued but not finished yet, the crawl is done once this gets to 0
+        self._pending = 0
+        self._stop = threading.Event()
+        self._checkpoint_lock = threading.Lock()
+
+        if self.checkpoint_path is not None and os.path.isfile(self.checkpoint_path):
+            self.load_checkpoint()
+        else:
+            for url in seeds:
+                self.add_url(url)
+
+    def add_url(self, url, depth=0, priority=None):
+        """
+        Queue the url if it has not been seen and is within the limits
+        """
+        if self.max_depth is not None and depth > self.max_depth:
+            return False
+
+        url = canonicalize_url(url)
+        if not url.startswith('http'):
+            return False
+
+        host = urllib.parse.urlsplit(url).netloc
+        if self.allowed_hosts is not None and host not in self.allowed_hosts:
+            return False
+        if self.link_filter is not None and not self.link_filter(url):
+            return False
+
+        with self._lock:
+            if self.seen.add(url) is False:
+                return False
+            self.stats['queued'] += 1
+            self._pending += 1
+
+        # Shallow pages first by default
+        self.frontier.push(url, depth=depth, priority=depth if priority is None else priority)
+        if self.dns_cache is not None:
+            # Resolve the host while the url waits in the frontier
+            self.dns_cache.prefetch(url)
+        return True
+
+    @staticmethod
+    def extract_links(page, base_url):
+        if isinstance(page, Selector):
+            hrefs = page.css('a::attr(href)').getall()
+        elif hasattr(page, 'find_all'):
+            hrefs = [a.get('href') for a in page.find_all('a', href=True)]
+        else:
+            return []
+
+        links = []
+        for href in hrefs:
+            href = href.strip()
+            if not href or href.startswith(('javascript:', 'mailto:', 'tel:', '#')):
+                continue
+            links.append(urllib.parse.urljoin(base_url, href))
+        return links
+
+    def _budget_left(self, url, depth):
+        with self._lock:
+            if self.max_pages is not None and self.stats['crawled'] + len(self._in_flight) >= self.max_pages:
+                # Keep the url queued so it is in the checkpoint, the crawl is over
+                self._stop.set()
+                self.frontier.push(url, depth=depth, priority=depth)
+                return False
+            if self.max_pages_per_host is not None:
+                host = urllib.parse.urlsplit(url).netloc
+                if self.host_counts.get(host, 0) >= self.max_pages_per_host:
+                    return False
+                self.host_counts[host] = self.host_counts.get(host, 0) + 1
+            self._in_flight[url] = depth
+            return True
+
+    def _crawl_page(self, web, url, depth):
+        page = web.get_site(url, page_format='html', parser=self.parser, **self.get_site_kwargs)
+        if page is None:
+            with self._lock:
+                self.stats['failed'] += 1
+            return
+
+        links = None
+        if self.on_page is not None:
+            links = self.on_page(web, url, page, depth)
+        if links is None:
+            links = self.extract_links(page, web.url or url)
+
+        for link in links:
+            self.add_url(link, depth=depth + 1)
+
+        with self._lock:
+            self.stats['crawled'] += 1
+            crawled = self.stats['crawled']
+
+        if self.checkpoint_path is not None and crawled % self.checkpoint_every == 0:
+            self.save_checkpoint()
+
+    def _worker(self):
+        web = self.web_factory()
+        try:
+            while not self._stop.is_set():
+                item = self.frontier.pop(timeout=0.5)
+                if item is None:
+                    with self._lock:
+                        if self._pending == 0:
+                            # Nothing left to crawl and nothing that could add more
+                            self._stop.set()
+                    continue
+
+                url, depth = item
+                if self._budget_left(url, depth) is False:
+                    if not self._stop.is_set():
+                        # Only this host is out of budget, drop the url
+                        with self._lock:
+                            self._pending -= 1
+                    continue
+
+                try:
+                    self._crawl_page(web, url, depth)
+                except Exception:
+                    logger.exception("Failed to crawl {}".format(url))
+                    with self._lock:
+                        self.stats['failed'] += 1
+                finally:
+                    with self._lock:
+                        del self._in_flight[url]
+                        self._pending -= 1
+        finally:
+            try:
+                web.quit()
+            except Exception:
+                logger.exception("Failed to quit the crawler driver")
+
+    def run(self):
+        """
+        Crawl until the frontier is empty, the budget is used up or stop() is called
+        """
+        self._stop.clear()
+        threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self.checkpoint_path is not None:
+            self.save_checkpoint()
+        return self.stats
+
+    def stop(self):
+        self._stop.set()
+
+    def save_checkpoint(self, checkpoint_path=None):
+        """
+        Save the frontier, seen urls and stats so the crawl can be resumed
+        Urls being crawled when this runs are saved as queued, so they are crawled again
+        """
+        checkpoint_path = checkpoint_path or self.checkpoint_path
+        with self._lock:
+            frontier = self.frontier.to_list()
+            frontier.extend([url, depth, depth] for url, depth in self._in_flight.items())
+            seen = self.seen.copy()
+            stats = dict(self.stats)
+            host_counts = dict(self.host_counts)
+
+        # Encoding the seen urls is slow, do not hold up the workers for it
+        data = {'frontier': frontier,
+                'seen': seen.to_dict(),
+                'stats': stats,
+                'host_counts': host_counts,
+                }
+
+        with self._checkpoint_lock:
+            tmp_path = '{}.tmp'.format(checkpoint_path)
+            with open(tmp_path, 'w') as out_file:
+                json.dump(data, out_file)
+            os.replace(tmp_path, checkpoint_path)
+        logger.info("Saved crawl checkpoint to {}".format(checkpoint_path))
+
+    def load_checkpoint(self, checkpoint_path=None):
+        checkpoint_path = checkpoint_path or self.checkpoint_path
+        with open(checkpoint_path, 'r') as in_file:
+            data = json.load(in_file)
+
+        self.seen = BloomFilter.from_dict(data['seen'])
+        self.stats = data['stats']
+        self.host_counts = data['host_counts']
+        for url, depth, priority in data['frontier']:
+            self.frontier.push(url, depth=depth, priority=priority)
+        self._pending = len(self.frontier)
+        logger.info("Resuming crawl from {} with {} urls queued".format(checkpoint_path, len(self.frontier)))
@@ -0,0 +1,136 @@
+import time
+import socket
+import logging
+import threading
+import urllib.parse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib3.util.connection import allowed_gai_family
+
+logger = logging.getLogger(__name__)
+
+
+class DNSCache:
+    """
+    In process cache of getaddrinfo results for DriverRequests (pass it as `dns_cache=`)
+
+    Lookups are kept for `ttl` seconds, failed lookups for `negative_ttl` seconds so a dead
+    host does not cost a lookup on every retry. `prefetch` resolves hosts in the background
+    before they are requested (the Crawler does this for every url it queues).
+    `resolver` has the same signature as socket.getaddrinfo, swap it out to stub lookups.
+
+    Share one instance between drivers, it is thread safe
+    """
+
+    def __init__(self, ttl=300, negative_ttl=30, max_hosts=10000, resolver=socket.getaddrinfo, prefetch_workers=4):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_hosts = max_hosts
+        self.resolver = resolver
+        self.prefetch_workers = prefetch_workers
+
+        self._lock = threading.Lock()
+        # (host, port, family) -> (expires, addresses or the gaierror)
+        self._cache = OrderedDict()
+        self._prefetching = set()
+        self._executor = None
+        self._stats = {'hits': 0,
+                       'misses': 0,
+                       'negative_hits': 0,
+                       'prefetches': 0,
+                       }
+
+    def resolve(self, host, port, family=0):
+        """
+        Return the getaddrinfo results (SOCK_STREAM) for the host
+        Raises socket.gaierror if it could not be resolved
+        """
+        key = (host, port, family)
+        with self._lock:
+            item = self._cache.get(key)
+            if item is not None and item[0] > time.time():
+                self._cache.move_to_end(key)
+                if isinstance(item[1], socket.gaierror):
+                    self._stats['negative_hits'] += 1
+                    raise item[1]
+                self._stats['hits'] += 1
+                return item[1]
+            self._stats['misses'] += 1
+
+        return self._lookup(key)
+
+    def _lookup(self, key):
+        host, port, family = key
+        try:
+            result = self.resolver(host, port, family, socket.SOCK_STREAM)
+            ttl = self.ttl
+        except socket.gaierror as e:
+            logger.debug("Could not resolve {}: {}".format(host, e))
+            result = e
+            ttl = self.negative_ttl
+
+        with self._lock:
+            self._cache[key] = (time.time() + ttl, result)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_hosts:
+                self._cache.popitem(last=False)
+
+        if isinstance(result, socket.gaierror):
+            raise result
+        return result
+
+    def prefetch(self, url):
+        """
+        Resolve the host of `url` in the background if it is not cached yet
+        """
+        parts = urllib.parse.urlsplit(url)
+        if parts.hostname is None:
+            return
+        try:
+            port = parts.port or (443 if parts.scheme == 'https' else 80)
+        except ValueError:
+            return
+
+        # Same family DriverRequests resolves with, so the connection finds it in the cache
+        key = (parts.hostname, port, allowed_gai_family())
+        with self._lock:
+            item = self._cache.get(key)
+            if (item is not None and item[0] > time.time()) or key in self._prefetching:
+                return
+            self._prefetching.add(key)
+            self._stats['prefetches'] += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.prefetch_workers,
+                                                    thread_name_prefix='dns-prefetch')
+
+        self._executor.submit(self._prefetch, key)
+
+    def _prefetch(self, key):
+        try:
+            self._lookup(key)
+        except socket.gaierror:
+            pass
+        finally:
+            with self._lock:
+                self._prefetching.discard(key)
+
+    def stats(self):
+        """
+        Return the lookup counters and the hit rate (negative hits count as hits)
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._cache)
+
+        lookups = stats['hits'] + stats['negative_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['hits'] + stats['negative_hits']) / lookups if lookups else None
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
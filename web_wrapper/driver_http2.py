@@ -0,0 +1,295 @@
+import sys
+import time
+import logging
+import threading
+import http.cookiejar
+import urllib.parse
+import requests
+from web_wrapper.web import Web
+from web_wrapper.encoding import decode_response
+from web_wrapper.session_state import add_cookies_to_jar, cookies_from_jar
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+
+class Http2ClientPool:
+    """
+    httpx clients with HTTP/2 enabled, one per proxy, shared by any number of DriverHttp2's
+    Concurrent requests to a host over the same proxy are multiplexed as streams on a single
+    connection, a new connection is only opened if the server's stream limit is reached.
+
+    Give every thread its own driver and share the pool between them:
+
+        pool = Http2ClientPool()
+        web = DriverHttp2(client_pool=pool)
+        results = web.stream(urls, workers=50, web_factory=lambda: DriverHttp2(client_pool=pool))
+
+    With `http1=False` plain http urls use HTTP/2 with prior knowledge (h2c), https urls
+    always negotiate the protocol with ALPN
+    """
+
+    def __init__(self, http1=True, max_connections=100, max_keepalive_connections=20, keepalive_expiry=60,
+                 max_redirects=30, **client_kwargs):
+        if httpx is None:
+            raise ImportError("HTTP/2 support needs httpx, install it with `pip install 'httpx[http2]'`")
+
+        self.http1 = http1
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_keepalive_connections,
+                                   keepalive_expiry=keepalive_expiry)
+        self.max_redirects = max_redirects
+        self.client_kwargs = client_kwargs
+
+        self._lock = threading.Lock()
+        self._clients = {}
+        # (proxy, host) -> stream counters
+        self._streams = {}
+
+    def get_client(self, proxy=None):
+        with self._lock:
+            client = self._clients.get(proxy)
+            if client is None:
+                client = self._clients[proxy] = self._create_client(proxy)
+            return client
+
+    def _create_client(self, proxy):
+        client_kwargs = dict(http2=True,
+                             http1=self.http1,
+                             limits=self.limits,
+                             # Cookies are kept by each driver, never in the shared client
+                             cookies=http.cookiejar.CookieJar(http.cookiejar.DefaultCookiePolicy(allowed_domains=[])),
+                             max_redirects=self.max_redirects,
+                             **self.client_kwargs)
+        if proxy is None:
+            return httpx.Client(**client_kwargs)
+        try:
+            return httpx.Client(proxy=proxy, **client_kwargs)
+        except TypeError:
+            # httpx < 0.26
+            return httpx.Client(proxies=proxy, **client_kwargs)
+
+    def _get_streams(self, proxy, host):
+        streams = self._streams.get((proxy, host))
+        if streams is None:
+            streams = self._streams[(proxy, host)] = {'in_flight': 0,
+                                                      'peak_in_flight': 0,
+                                                      'requests': 0,
+                                                      'http_versions': {},
+                                                      }
+        return streams
+
+    def stream_started(self, proxy, host):
+        with self._lock:
+            streams = self._get_streams(proxy, host)
+            streams['in_flight'] += 1
+            streams['requests'] += 1
+            streams['peak_in_flight'] = max(streams['peak_in_flight'], streams['in_flight'])
+
+    def stream_finished(self, proxy, host, http_version=None):
+        with self._lock:
+            streams = self._get_streams(proxy, host)
+            streams['in_flight'] -= 1
+            if http_version is not None:
+                streams['http_versions'][http_version] = streams['http_versions'].get(http_version, 0) + 1
+
+    def _connections(self, client):
+        """
+        Number of open connections per host in the client's pool
+        """
+        counts = {}
+        try:
+            for connection in client._transport._pool.connections:
+                origin = connection._origin
+                host = origin.host.decode('ascii')
+                if origin.port is not None and origin.port not in (80, 443):
+                    host = '{}:{}'.format(host, origin.port)
+                counts[host] = counts.get(host, 0) + 1
+        except AttributeError:
+            logger.debug("Could not read the httpx connection pool")
+        return counts
+
+    def stats(self):
+        """
+        Stream concurrency per proxy (`None` is for direct connections) and host
+        `peak_in_flight` is the most requests that were running at the same time
+        """
+        with self._lock:
+            clients = dict(self._clients)
+            stats = {}
+            for (proxy, host), streams in self._streams.items():
+                stats.setdefault(proxy, {})[host] = dict(streams, http_versions=dict(streams['http_versions']))
+
+        for proxy, client in clients.items():
+            for host, count in self._connections(client).items():
+                if host in stats.get(proxy, {}):
+                    stats[proxy][host]['connections'] = count
+
+        return stats
+
+    def close(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients = {}
+        for client in clients:
+            client.close()
+
+
+class DriverHttp2(Web):
+    """
+    Driver using httpx with HTTP/2, see Http2ClientPool for sharing connections between drivers
+    Headers and cookies belong to each driver, the connections belong to the pool.
+    Errors are raised as the requests exceptions so get_site retries them the same way.
+    """
+
+    def __init__(self, *args, client_pool=None, http1=True, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.driver_type = 'http2'
+
+        self._own_pool = client_pool is None
+        if client_pool is None:
+            client_pool = Http2ClientPool(http1=http1, **self.driver_args)
+        self.client_pool = client_pool
+
+        self._create_session()
+
+    # Headers Set/Get
+    def get_headers(self):
+        return self.session_headers
+
+    def set_headers(self, headers):
+        self.session_headers = httpx.Headers(headers)
+
+    def update_headers(self, headers):
+        self.session_headers.update(headers)
+
+    # Cookies Set/Get
+    def get_cookies(self):
+        return {cookie.name: cookie.value for cookie in self.session_cookies.jar}
+
+    def set_cookies(self, cookies):
+        self.session_cookies.clear()
+        self.update_cookies(cookies)
+
+    def update_cookies(self, cookies):
+        add_cookies_to_jar(self.session_cookies.jar, cookies)
+
+    # Session state
+    def _export_cookies(self):
+        return cookies_from_jar(self.session_cookies.jar)
+
+    def _export_headers(self):
+        return dict(self.session_headers)
+
+    def _export_local_storage(self):
+        return {}
+
+    def _import_local_storage(self, local_storage):
+        if local_storage:
+            logger.debug("http2 has no local storage, skipping it")
+
+    # Proxy Set/Get
+    def set_proxy(self, proxy):
+        """
+        Requests go through the pool's client for this proxy
+        """
+        self.current_proxy = proxy
+        self.driver = self.client_pool.get_client(proxy)
+
+    def get_proxy(self):
+        return self.current_proxy
+
+    # Session
+    def _create_session(self):
+        """
+        Fresh headers and cookies, the connections in the pool are kept
+        """
+        self.session_headers = httpx.Headers(self.current_headers)
+        self.session_cookies = httpx.Cookies()
+        self.update_cookies(self.current_cookies)
+        self.set_proxy(self.current_proxy)
+
+    def reset(self):
+        self._create_session()
+
+    def quit(self):
+        if self._own_pool is True:
+            self.client_pool.close()
+        self.driver = None
+
+    def stream_stats(self):
+        return self.client_pool.stats()
+
+    # Actions
+    def _send(self, url, headers, cookies, timeout, driver_kwargs):
+        """
+        Send the request, following redirects here so this driver's cookie jar is used for each hop
+        """
+        client = self.driver
+        request = client.build_request('GET', url, headers=headers, timeout=timeout, **driver_kwargs)
+        for _ in range(client.max_redirects + 1):
+            request.headers.pop('Cookie', None)
+            cookies.set_cookie_header(request)
+            response = client.send(request, follow_redirects=False)
+            cookies.extract_cookies(response)
+            if response.next_request is None:
+                return response
+            response.close()
+            request = response.next_request
+
+        raise requests.exceptions.TooManyRedirects("Exceeded {} redirects".format(client.max_redirects))
+
+    def _get_site(self, url, headers, cookies, timeout, driver_args, driver_kwargs):
+        """
+        Try and return page content in the requested format using httpx
+        """
+        request_headers = httpx.Headers(self.session_headers)
+        request_headers.update(headers)
+        request_cookies = self.session_cookies
+        if cookies:
+            # Only for this request
+            request_cookies = httpx.Cookies(self.session_cookies)
+            add_cookies_to_jar(request_cookies.jar, cookies)
+
+        host = urllib.parse.urlsplit(url).netloc
+        http_version = None
+        self.client_pool.stream_started(self.current_proxy, host)
+        try:
+            request_start = time.perf_counter()
+            response = self._send(url, request_headers, request_cookies, timeout, driver_kwargs)
+            self.timings['download'] = time.perf_counter() - request_start
+            http_version = response.http_version
+
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(str(e)).with_traceback(sys.exc_info()[2])
+
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(str(e)).with_traceback(sys.exc_info()[2])
+
+        finally:
+            self.client_pool.stream_finished(self.current_proxy, host, http_version)
+
+        # Set data to access from script
+        self.status_code = response.status_code
+        self.url = str(response.url)
+        self.response = response
+        self.transfer = {'wire_bytes': response.num_bytes_downloaded,
+                         'decoded_bytes': len(response.content),
+                         'content_encoding': response.headers.get('Content-Encoding', 'identity'),
+                         'http_version': http_version,
+                         }
+
+        if response.status_code >= 400:
+            raise requests.exceptions.HTTPError("Status code >= 400", response=response)
+
+        decode_start = time.perf_counter()
+        source_text, encoding, encoding_source = decode_response(response)
+        self.timings['decode'] = time.perf_counter() - decode_start
+        self.transfer['encoding'] = encoding
+        self.transfer['encoding_source'] = encoding_source
+
+        return source_text
@@ -0,0 +1,211 @@
+import re
+import json
+import logging
+import requests
+from web_wrapper.web import Web
+from web_wrapper.driver_requests import DriverRequests
+from web_wrapper.driver_selenium_chrome import DriverSeleniumChrome
+from web_wrapper.selenium_utils import SeleniumHTTPError
+
+logger = logging.getLogger(__name__)
+
+
+class DriverHybrid(Web):
+    """
+    Load the first page with a browser (to get past js challenges or token setup), then move
+    the cookies, user agent and headers over to a requests session and use that for every
+    request after. Goes back to the browser only if a page looks like a challenge again:
+        - it matches any of `challenge_checks` or the `custom_source_checks` passed to get_site
+        - or the status code is in `challenge_status_codes`
+
+    `browser_kwargs` are passed to DriverSeleniumChrome, `requests_kwargs` to DriverRequests
+    """
+
+    def __init__(self, *args, challenge_checks=[], challenge_status_codes=(403, 503), browser_kwargs={},
+                 requests_kwargs={}, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.driver_type = 'hybrid'
+
+        self.challenge_checks = challenge_checks
+        self.challenge_status_codes = challenge_status_codes
+        self.browser_kwargs = browser_kwargs
+        self.requests_kwargs = requests_kwargs
+
+        # The browser is only started when it is needed
+        self.browser = None
+        self.used_browser = False
+        self._bootstrapped = False
+        self._source_checks = []
+
+        self.http = DriverRequests(headers=dict(self.current_headers),
+                                   cookies=self.current_cookies,
+                                   proxy=self.current_proxy,
+                                   **self.requests_kwargs)
+        self.driver = self.http.driver
+
+    # Headers Set/Get
+    def get_headers(self):
+        return self.http.get_headers()
+
+    def set_headers(self, headers):
+        self.current_headers = headers
+        self.http.set_headers(headers)
+        if self.browser is not None:
+            self.browser.set_headers(dict(headers))
+
+    def update_headers(self, headers):
+        self.current_headers.update(headers)
+        self.http.update_headers(headers)
+        if self.browser is not None:
+            self.browser.update_headers(headers)
+
+    # Cookies Set/Get
+    def get_cookies(self):
+        return self.http.get_cookies()
+
+    def set_cookies(self, cookies):
+        self.http.set_cookies(cookies)
+        if self.browser is not None:
+            self.browser.set_cookies(cookies)
+
+    def update_cookies(self, cookies):
+        self.http.update_cookies(cookies)
+        if self.browser is not None:
+            self.browser.update_cookies(cookies)
+
+    # Proxy Set/Get
+    def set_proxy(self, proxy):
+        self.current_proxy = proxy
+        self.http.set_proxy(proxy)
+        if self.browser is not None:
+            self.browser.set_proxy(proxy)
+
+    def get_proxy(self):
+        return self.current_proxy
+
+    # Session state
+    def _export_cookies(self):
+        return self.http._export_cookies()
+
+    def _export_headers(self):
+        return self.http._export_headers()
+
+    def _export_local_storage(self):
+        if self.browser is None:
+            return {}
+        return self.browser._export_local_storage()
+
+    def _import_local_storage(self, local_storage):
+        if self.browser is not None:
+            self.browser._import_local_storage(local_storage)
+
+    # Session
+    def _start_browser(self):
+        logger.debug("Start hybrid browser")
+        self.browser = DriverSeleniumChrome(headers=dict(self.current_headers),
+                                            cookies=self.http._export_cookies(),
+                                            proxy=self.current_proxy,
+                                            **self.browser_kwargs)
+        # So the browser knows when navigation timings are wanted
+        self.browser.hooks = self.hooks
+
+    def reset(self):
+        """
+        Start over, the next request will go through the browser again
+        """
+        self.http.reset()
+        self.driver = self.http.driver
+        if self.browser is not None:
+            self.browser.reset()
+        self._bootstrapped = False
+
+    def quit(self):
+        self.http.quit()
+        if self.browser is not None:
+            self.browser.quit()
+            self.browser = None
+        self.driver = None
+
+    # Actions
+    def get_site(self, url, *args, **kwargs):
+        # Keep the checks so _get_site can tell if it got a challenge page
+        self._source_checks = [re_text for re_text, _ in kwargs.get('custom_source_checks', [])]
+        return super().get_site(url, *args, **kwargs)
+
+    def _is_challenge(self, source_text):
+        for re_text in list(self.challenge_checks) + self._source_checks:
+            if re.search(re_text, source_text):
+                return True
+        return False
+
+    def _get_site(self, url, headers, cookies, timeout, driver_args, driver_kwargs):
+        if self._bootstrapped is False:
+            return self._get_site_browser(url, headers, cookies, timeout)
+
+        self.http.timings = {}
+        try:
+            source_text = self.http._get_site(url, headers, cookies, timeout, driver_args, driver_kwargs)
+        except requests.exceptions.HTTPError as e:
+            self._copy_response(self.http)
+            if e.response is not None and e.response.status_code in self.challenge_status_codes:
+                logger.info("Got status {} over http, using the browser for {}".format(e.response.status_code, url))
+                return self._get_site_browser(url, headers, cookies, timeout)
+            raise
+        self._copy_response(self.http)
+
+        if source_text is not None and self._is_challenge(source_text):
+            logger.info("Got a challenge page over http, using the browser for {}".format(url))
+            return self._get_site_browser(url, headers, cookies, timeout)
+
+        self.used_browser = False
+        return source_text
+
+    def _get_site_browser(self, url, headers, cookies, timeout):
+        """
+        Load the page in the browser, then hand its session over to requests
+        """
+        if self.browser is None:
+            self._start_browser()
+        else:
+            # Pick up any cookies requests got since the last time
+            self.browser.update_cookies(self.http._export_cookies())
+
+        self.used_browser = True
+        self.browser.timings = {}
+        try:
+            source_text = self.browser._get_site(url, headers, cookies, timeout, (), {})
+        except SeleniumHTTPError:
+            self._copy_response(self.browser)
+            raise
+        self._copy_response(self.browser)
+
+        self._hand_off()
+        return source_text
+
+    def _fetch_robots(self, robots_url):
+        # robots.txt never needs the browser, it is still recorded & replayed with this driver's archive
+        self.http.archive = self.archive
+        return self.http._fetch_robots(robots_url)
+
+    def _hand_off(self):
+        state = self.browser.get_state()
+        self.http.update_headers(state['headers'])
+        self.http.update_cookies(state['cookies'])
+        self._bootstrapped = True
+        logger.debug("Moved {} cookies from the browser to requests".format(len(state['cookies'])))
+
+    def _copy_response(self, web):
+        self.status_code = web.status_code
+        self.url = web.url
+        self.response = web.response
+        self.timings.update(web.timings)
+        self.transfer = dict(web.transfer)
+        if self.retain_response is False:
+            web.response = None
+
+    def parse_source(self, source, page_format, parser):
+        if page_format == 'json':
+            if self.used_browser is True:
+                return json.loads(self.browser.driver.find_element_by_tag_name('body').text)
+            return json.loads(source)
+        return super().parse_source(source, page_format, parser)
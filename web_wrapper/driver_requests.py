@@ -1,24 +1,149 @@
 import sys
+import time
+import socket
 import requests
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError, ConnectTimeoutError
+from urllib3.util.connection import allowed_gai_family
 from web_wrapper.web import Web
+from web_wrapper.session_state import add_cookies_to_jar, cookies_from_jar
+from web_wrapper.encoding import ACCEPT_ENCODING, decode_response
 import logging
 
+try:
+    from urllib3.exceptions import NameResolutionError
+except ImportError:
+    # urllib3 < 2
+    NameResolutionError = None
+
 logger = logging.getLogger(__name__)
 
 
+class DNSCacheConnectionMixin:
+    """
+    Resolve the host using `dns_cache` instead of a getaddrinfo call for every new connection
+    Each address is tried in order, the same as urllib3 does
+    """
+    dns_cache = None
+
+    def _new_conn(self):
+        dns_host = self._dns_host
+        try:
+            addresses = self.dns_cache.resolve(dns_host.strip('[]'), self.port, allowed_gai_family())
+        except socket.gaierror as e:
+            if NameResolutionError is not None:
+                raise NameResolutionError(self.host, self, e) from e
+            raise NewConnectionError(self, "Failed to resolve {}: {}".format(self.host, e))
+
+        error = None
+        # The host name is still used for the Host header and TLS, only the connect uses the ip
+        try:
+            for ip in list(OrderedDict.fromkeys(address[4][0] for address in addresses)):
+                self._dns_host = ip
+                try:
+                    return super()._new_conn()
+                except (NewConnectionError, ConnectTimeoutError) as e:
+                    error = e
+        finally:
+            self._dns_host = dns_host
+
+        if error is None:
+            raise NewConnectionError(self, "No addresses found for {}".format(self.host))
+        raise error
+
+
+def dns_cache_pool_classes(dns_cache):
+    """
+    Connection pool classes, by scheme, that use `dns_cache`
+    """
+    http_connection = type('DNSCacheHTTPConnection', (DNSCacheConnectionMixin, HTTPConnection),
+                           {'dns_cache': dns_cache})
+    https_connection = type('DNSCacheHTTPSConnection', (DNSCacheConnectionMixin, HTTPSConnection),
+                            {'dns_cache': dns_cache})
+    return {'http': type('DNSCacheHTTPConnectionPool', (HTTPConnectionPool,), {'ConnectionCls': http_connection}),
+            'https': type('DNSCacheHTTPSConnectionPool', (HTTPSConnectionPool,), {'ConnectionCls': https_connection}),
+            }
+
+
+class PoolAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that sets socket options (tcp keep-alive) on every connection,
+    including the ones made through a proxy
+    Each proxy already gets its own pool in `self.proxy_manager`
+    With a `dns_cache` new connections look up the host (or proxy) in it
+    """
+
+    def __init__(self, socket_options=None, dns_cache=None, **kwargs):
+        self.socket_options = socket_options
+        self.dns_cache = dns_cache
+        self.pool_classes = dns_cache_pool_classes(dns_cache) if dns_cache is not None else None
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.socket_options is not None:
+            kwargs['socket_options'] = self.socket_options
+        super().init_poolmanager(*args, **kwargs)
+        if self.pool_classes is not None:
+            self.poolmanager.pool_classes_by_scheme = self.pool_classes
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        if self.socket_options is not None:
+            proxy_kwargs['socket_options'] = self.socket_options
+        manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+        if self.pool_classes is not None:
+            manager.pool_classes_by_scheme = self.pool_classes
+        return manager
+
+
 class DriverRequests(Web):
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, pool_connections=10, pool_maxsize=10, pool_block=False, max_retries=0,
+                 keep_alive=True, keep_alive_idle=60, keep_alive_interval=10, keep_alive_count=6, dns_cache=None,
+                 **kwargs):
         super().__init__(*args, **kwargs)
         self.driver_type = 'requests'
 
+        # Connection pools live on the adapter so they survive reset() and profile rotations
+        socket_options = None
+        if keep_alive is True:
+            socket_options = self._keep_alive_socket_options(keep_alive_idle, keep_alive_interval, keep_alive_count)
+        self.dns_cache = dns_cache
+        self.adapter = PoolAdapter(socket_options=socket_options,
+                                   dns_cache=dns_cache,
+                                   pool_connections=pool_connections,
+                                   pool_maxsize=pool_maxsize,
+                                   pool_block=pool_block,
+                                   max_retries=max_retries,
+                                   )
+
         self._create_session()
 
+    def _keep_alive_socket_options(self, idle, interval, count):
+        """
+        Socket options to keep idle connections alive, platforms that do not
+        support the tuning options only get SO_KEEPALIVE
+        """
+        socket_options = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        for option_name, value in (('TCP_KEEPIDLE', idle),
+                                   ('TCP_KEEPINTVL', interval),
+                                   ('TCP_KEEPCNT', count),
+                                   ):
+            if hasattr(socket, option_name):
+                socket_options.append((socket.IPPROTO_TCP, getattr(socket, option_name), value))
+
+        return socket_options
+
     # Headers Set/Get
     def get_headers(self):
         return self.driver.headers
 
     def set_headers(self, headers):
+        headers = requests.structures.CaseInsensitiveDict(headers)
+        # Without it the server sends the page uncompressed
+        headers.setdefault('Accept-Encoding', ACCEPT_ENCODING)
         self.driver.headers = headers
 
     def update_headers(self, headers):
@@ -28,27 +153,30 @@ class DriverRequests(Web):
     def get_cookies(self):
         return self.driver.cookies.get_dict()
 
-    def _clean_cookies(self, cookies):
-        clean_cookies = []
+    def set_cookies(self, cookies):
+        self.driver.cookies.clear()
+        self.update_cookies(cookies)
 
-        if isinstance(cookies, dict) is True:
-            cookies = [cookies]
+    def update_cookies(self, cookies):
+        add_cookies_to_jar(self.driver.cookies, cookies)
 
-        for cookie in cookies:
-            if 'name' in cookie and 'value' in cookie:
-                clean_cookies.append({cookie['name']: cookie['value']})
-            else:
-                name = list(cookie.keys())[0]
-                clean_cookies.append({name: cookie[name]})
+    # Session state
+    def _export_cookies(self):
+        return cookies_from_jar(self.driver.cookies)
 
-        return clean_cookies
+    def _export_headers(self):
+        """
+        Only the headers that were set, not the defaults requests adds (like its user agent)
+        """
+        default_headers = requests.utils.default_headers()
+        return {key: value for key, value in self.driver.headers.items() if default_headers.get(key) != value}
 
-    def set_cookies(self, cookies):
-        self.driver.cookies = self._clean_cookies(cookies)
+    def _export_local_storage(self):
+        return {}
 
-    def update_cookies(self, cookies):
-        for cookie in self._clean_cookies(cookies):
-            self.driver.cookies.update(cookie)
+    def _import_local_storage(self, local_storage):
+        if local_storage:
+            logger.debug("requests has no local storage, skipping it")
 
     # Proxy Set/Get
     def set_proxy(self, proxy):
@@ -77,6 +205,9 @@ class DriverRequests(Web):
         Creates a fresh session with the default header (random UA)
         """
         self.driver = requests.Session(**self.driver_args)
+        # Reuse the same pools (and their warm connections) on every session
+        self.driver.mount('http://', self.adapter)
+        self.driver.mount('https://', self.adapter)
         # Set default headers
         self.update_headers(self.current_headers)
         self.update_cookies(self.current_cookies)
@@ -94,6 +225,40 @@ class DriverRequests(Web):
         Generic function to close distroy and session data
         """
         self.driver = None
+        self.adapter.close()
+
+    def pool_stats(self):
+        """
+        Return the connection pool usage per proxy (`None` is for direct connections)
+        `reused` is how many requests did not need a new connection
+        """
+        managers = {None: self.adapter.poolmanager}
+        managers.update(self.adapter.proxy_manager)
+
+        stats = {}
+        for proxy, manager in managers.items():
+            proxy_stats = {'pools': 0, 'connections': 0, 'requests': 0}
+            for pool_key in manager.pools.keys():
+                pool = manager.pools.get(pool_key)
+                if pool is None:
+                    continue
+                proxy_stats['pools'] += 1
+                proxy_stats['connections'] += pool.num_connections
+                proxy_stats['requests'] += pool.num_requests
+            proxy_stats['reused'] = max(0, proxy_stats['requests'] - proxy_stats['connections'])
+            stats[proxy] = proxy_stats
+
+        return stats
+
+    @staticmethod
+    def _wire_bytes(response):
+        """
+        Size of the body as it came over the wire (before gzip/br/zstd was removed)
+        """
+        try:
+            return response.raw.tell()
+        except Exception:
+            return None
 
     # Actions
     def _get_site(self, url, headers, cookies, timeout, driver_args, driver_kwargs):
@@ -103,21 +268,37 @@ class DriverRequests(Web):
         try:
             # Headers and cookies are combined to the ones stored in the requests session
             #  Ones passed in here will override the ones in the session if they are the same key
+            request_start = time.perf_counter()
             response = self.driver.get(url,
                                        *driver_args,
                                        headers=headers,
                                        cookies=cookies,
                                        timeout=timeout,
                                        **driver_kwargs)
+            request_time = time.perf_counter() - request_start
 
             # Set data to access from script
             self.status_code = response.status_code
             self.url = response.url
             self.response = response
+            # `elapsed` stops once the headers are parsed, the rest is reading the body
+            self.timings['ttfb'] = response.elapsed.total_seconds()
+            self.timings['download'] = max(0, request_time - self.timings['ttfb'])
+
+            self.transfer = {'wire_bytes': self._wire_bytes(response),
+                             'decoded_bytes': len(response.content),
+                             'content_encoding': response.headers.get('Content-Encoding', 'identity'),
+                             }
 
             response.raise_for_status()
 
-            return response.text
+            decode_start = time.perf_counter()
+            source_text, encoding, encoding_source = decode_response(response)
+            self.timings['decode'] = time.perf_counter() - decode_start
+            self.transfer['encoding'] = encoding
+            self.transfer['encoding_source'] = encoding_source
+
+            return source_text
 
         except Exception as e:
             raise e.with_traceback(sys.exc_info()[2])
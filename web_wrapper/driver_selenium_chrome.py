@@ -76,6 +76,9 @@ class DriverSeleniumChrome(Web, SeleniumUtils):
         """
         self.driver = webdriver.Chrome(chrome_options=self.opts, **self.driver_args)
         self.driver.set_window_size(1920, 1080)
+        self._reset_pending_state()
+        if self.current_cookies:
+            self._import_cookies(self.current_cookies)
 
     def _update(self):
         """
@@ -1,8 +1,10 @@
 import cutil
 import logging
+import urllib.parse
 from selenium import webdriver
 from web_wrapper.web import Web
 from web_wrapper.selenium_utils import SeleniumUtils
+from web_wrapper.session_state import normalize_cookies, merge_cookies
 
 
 logger = logging.getLogger(__name__)
@@ -13,8 +15,9 @@ class DriverSeleniumPhantomJS(Web, SeleniumUtils):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.driver_type = 'selenium_phantomjs'
-        self.default_service_args = self.driver_args.get('service_args', [])
-        self.driver_args['service_args'] = self.default_service_args
+        # Keep our own copy so proxy flags never leak into the list the user passed in
+        self.default_service_args = list(self.driver_args.get('service_args', []))
+        self.driver_args['service_args'] = list(self.default_service_args)
         self.dcap = dict(webdriver.DesiredCapabilities.PHANTOMJS)
         self.set_headers(self.current_headers, update=False)
         self.set_proxy(self.current_proxy, update=False)
@@ -32,9 +35,12 @@ class DriverSeleniumPhantomJS(Web, SeleniumUtils):
         for key, value in headers.items():
             self.dcap['phantomjs.page.customHeaders.{}'.format(key)] = value
 
-        if update is True:
-            # Recreate webdriver with new header
-            self._update()
+        if update is True and self.driver is not None:
+            # Try and change the headers on the running page, only restart if that fails
+            script = "this.customHeaders = arguments[0];"
+            if self._execute_phantom_script(script, headers) is False:
+                # Recreate webdriver with new header
+                self._update()
 
     def get_headers(self):
         # TODO: Try and get from phantom directly to be accurate
@@ -49,20 +55,51 @@ class DriverSeleniumPhantomJS(Web, SeleniumUtils):
         return self.driver.get_cookies()
 
     def set_cookies(self, cookies):
-        # TODO: Does not seem to actually set them correctly
-        self.driver.delete_all_cookies()
-        for cookie in cookies:
-            print(cookie)
-            self.driver.add_cookie({k: cookie[k] for k in ('name', 'value', 'path', 'expirationDate', 'expiry', 'domain') if k in cookie})
+        self.current_cookies = normalize_cookies(cookies)
+        if self._execute_phantom_script("phantom.clearCookies();") is False:
+            self.driver.delete_all_cookies()
+        self._pending_cookies = []
+        self._import_cookies(self.current_cookies)
 
     def update_cookies(self, cookies):
-        self.current_cookies.expand(cookies)
-        self.set_cookies(self.current_cookies)
+        self.current_cookies = merge_cookies(self.current_cookies, cookies)
+        self._import_cookies(cookies)
+
+    def _export_cookies(self):
+        # phantomjs returns the cookies for every domain
+        return normalize_cookies(self.driver.get_cookies())
+
+    def _set_browser_cookie(self, cookie, url=None):
+        """
+        Use phantom.addCookie so cookies can be set for any domain, not only the current page's
+        phantomjs needs a domain, so cookies without one are set for the host of `url`
+        Returns False if the cookie could not be set
+        """
+        domain = cookie.get('domain')
+        if domain is None and url is not None:
+            domain = urllib.parse.urlsplit(url).hostname
+        if not domain:
+            return False
+
+        phantom_cookie = {'name': cookie['name'],
+                          'value': cookie['value'],
+                          'domain': domain,
+                          'path': cookie.get('path', '/'),
+                          'secure': cookie.get('secure', False),
+                          'httponly': cookie.get('httpOnly', False),
+                          }
+        if cookie.get('expiry') is not None:
+            # phantomjs wants milliseconds
+            phantom_cookie['expires'] = cookie['expiry'] * 1000
+        # addCookie returns false when phantomjs rejects the cookie
+        return self._execute_phantom_script("return phantom.addCookie(arguments[0]);", phantom_cookie) is True
 
     # Proxy Set/Get
     def set_proxy(self, proxy, update=True):
         """
-        Set proxy for requests session
+        Set proxy for phantomjs session
+        Switches the proxy of the running process using `phantom.setProxy`,
+        only restarts phantomjs if that is not possible
         """
         update_web_driver = False
         if self.current_proxy != proxy:
@@ -70,20 +107,69 @@ class DriverSeleniumPhantomJS(Web, SeleniumUtils):
             update_web_driver = True
 
         self.current_proxy = proxy
+
+        # Always rebuild from the defaults so proxy flags do not pile up between rotations
+        #   These are only used if the process needs to be (re)started
+        self.driver_args['service_args'] = self.default_service_args + self._proxy_service_args(proxy)
+
+        if update is True and update_web_driver is True:
+            if self._set_running_proxy(proxy) is False:
+                # Recreate webdriver with new proxy settings
+                self._update()
+
+    def _proxy_service_args(self, proxy):
+        """
+        Build the phantomjs command line args needed to use the proxy
+        """
         if proxy is None:
-            self.driver_args['service_args'] = self.default_service_args
+            return []
+
+        proxy_parts = cutil.get_proxy_parts(proxy)
+        service_args = ['--proxy={host}:{port}'.format(**proxy_parts),
+                        '--proxy-type={schema}'.format(**proxy_parts),
+                        ]
+        if proxy_parts.get('user') is not None:
+            service_args.append('--proxy-auth={user}:{password}'.format(**proxy_parts))
+
+        return service_args
+
+    def _set_running_proxy(self, proxy):
+        """
+        Change the proxy of the running phantomjs process
+        Return False if it could not be done
+        """
+        if self.driver is None:
+            return False
+
+        if proxy is None:
+            # An empty host tells phantomjs to stop using a proxy
+            proxy_args = ['', 0, 'http', '', '']
         else:
             proxy_parts = cutil.get_proxy_parts(proxy)
+            proxy_args = [proxy_parts['host'],
+                          int(proxy_parts['port']),
+                          proxy_parts.get('schema') or 'http',
+                          proxy_parts.get('user') or '',
+                          proxy_parts.get('password') or '',
+                          ]
 
-            self.driver_args['service_args'].extend(['--proxy={host}:{port}'.format(**proxy_parts),
-                                                     '--proxy-type={schema}'.format(**proxy_parts),
-                                                     ])
-            if proxy_parts.get('user') is not None:
-                self.driver_args['service_args'].append('--proxy-auth={user}:{password}'.format(**proxy_parts))
+        script = "phantom.setProxy.apply(phantom, arguments);"
+        return self._execute_phantom_script(script, *proxy_args)
 
-        # Recreate webdriver with new proxy settings
-        if update is True and update_web_driver is True:
-            self._update()
+    def _execute_phantom_script(self, script, *args):
+        """
+        Run javascript in the phantomjs context (not the page's)
+        `this` in the script is the current page object
+        Returns what the script returns, or False if the script could not be run
+        """
+        try:
+            if 'executePhantomScript' not in self.driver.command_executor._commands:
+                self.driver.command_executor._commands['executePhantomScript'] = \
+                    ('POST', '/session/$sessionId/phantom/execute')
+            return self.driver.execute('executePhantomScript', {'script': script, 'args': list(args)})['value']
+        except Exception:
+            logger.warning("Could not run phantom script", exc_info=True)
+            return False
 
     def get_proxy(self):
         return self.current_proxy
@@ -96,6 +182,7 @@ class DriverSeleniumPhantomJS(Web, SeleniumUtils):
         logger.debug("Create new phantomjs web driver")
         self.driver = webdriver.PhantomJS(desired_capabilities=self.dcap,
                                           **self.driver_args)
+        self._reset_pending_state()
         self.set_cookies(self.current_cookies)
         self.driver.set_window_size(1920, 1080)
 
@@ -114,7 +201,8 @@ class DriverSeleniumPhantomJS(Web, SeleniumUtils):
         # Kill old connection
         self.quit()
         # Clear proxy data
-        self.driver_args['service_args'] = self.default_service_args
+        self.current_proxy = None
+        self.driver_args['service_args'] = list(self.default_service_args)
         # Clear headers
         self.dcap = dict(webdriver.DesiredCapabilities.PHANTOMJS)
         # Create new web driver
@@ -0,0 +1,90 @@
+import re
+import codecs
+import logging
+import requests
+from requests.compat import chardet
+
+logger = logging.getLogger(__name__)
+
+# requests builds this from what urllib3 can decode, so `br` and `zstd` are in it
+# when brotli (or brotlicffi) and zstandard are installed
+ACCEPT_ENCODING = requests.utils.default_headers()['Accept-Encoding']
+
+# How far into the body to look for a <meta> charset
+SNIFF_BYTES = 2048
+
+_BOMS = ((codecs.BOM_UTF8, 'utf-8-sig'),
+         (codecs.BOM_UTF32_LE, 'utf-32'),
+         (codecs.BOM_UTF32_BE, 'utf-32'),
+         (codecs.BOM_UTF16_LE, 'utf-16'),
+         (codecs.BOM_UTF16_BE, 'utf-16'),
+         )
+
+_HEADER_CHARSET_RE = re.compile(r'charset\s*=\s*["\']?([\w.:-]+)', re.I)
+_META_CHARSET_RE = re.compile(br'<meta[^>]+charset\s*=\s*["\']?\s*([\w.:-]+)', re.I)
+_XML_ENCODING_RE = re.compile(br'^<\?xml[^>]+encoding\s*=\s*["\']([\w.:-]+)', re.I)
+
+
+def _valid_encoding(encoding):
+    try:
+        return codecs.lookup(encoding.decode('ascii') if isinstance(encoding, bytes) else encoding).name
+    except (LookupError, UnicodeDecodeError):
+        return None
+
+
+def _declared_encoding(content, content_type):
+    """
+    Encoding from the content-type header, a byte order mark or a <meta> tag
+    """
+    if content_type:
+        match = _HEADER_CHARSET_RE.search(content_type)
+        if match:
+            encoding = _valid_encoding(match.group(1))
+            if encoding is not None:
+                return encoding, 'header'
+
+    for bom, encoding in _BOMS:
+        if content.startswith(bom):
+            return encoding, 'bom'
+
+    head = content[:SNIFF_BYTES]
+    match = _META_CHARSET_RE.search(head) or _XML_ENCODING_RE.search(head)
+    if match:
+        encoding = _valid_encoding(match.group(1))
+        if encoding is not None:
+            return encoding, 'meta'
+
+    return None, None
+
+
+def _guess_encoding(content):
+    return chardet.detect(content)['encoding'] or 'utf-8'
+
+
+def decode_response(response):
+    """
+    Decode the body of a requests response, returns (text, encoding, source)
+    The encoding is found using the cheapest check that works, `source` is which one:
+        header: charset in the content-type header
+        bom: byte order mark
+        meta: <meta charset> or the <?xml encoding> near the start of the body
+        utf-8: the body is valid utf-8
+        detected: charset_normalizer/chardet had to guess (slow on big pages)
+    Unlike `response.text` this does not use ISO-8859-1 for text/* pages without a charset
+    """
+    content = response.content
+    if not content:
+        return '', response.encoding, 'empty'
+
+    encoding, source = _declared_encoding(content, response.headers.get('Content-Type'))
+    if encoding is None:
+        try:
+            # Most pages are utf-8, so try it before guessing
+            text = content.decode('utf-8')
+            response.encoding = 'utf-8'
+            return text, 'utf-8', 'utf-8'
+        except UnicodeDecodeError:
+            encoding, source = _guess_encoding(content), 'detected'
+
+    response.encoding = encoding
+    return content.decode(encoding, errors='replace'), encoding, source
@@ -0,0 +1,226 @@
+import re
+import logging
+import lxml.html
+from lxml import etree
+from concurrent.futures import ProcessPoolExecutor
+from parsel import Selector
+from parsel.csstranslator import css2xpath
+
+logger = logging.getLogger(__name__)
+
+
+class Field:
+    """
+    A single value to extract from a page
+
+    css/xpath - Select the nodes (css supports `::text` and `::attr(name)`)
+    regex     - Run on the text of the selected nodes (or the whole page if no selector is set),
+                the first group is used if the regex has any
+    many      - Return a list of every match instead of the first one
+    type      - Callable to convert the value with (int, float, ...), `default` is used if it fails
+    schema    - Nested Schema (or dict of Fields) applied to each selected node
+    """
+
+    def __init__(self, css=None, xpath=None, regex=None, many=False, type=None, default=None, schema=None,
+                 strip=True):
+        if css is not None and xpath is not None:
+            raise ValueError("Only one of css or xpath can be set")
+        if schema is not None and css is None and xpath is None:
+            raise ValueError("A nested schema needs a css or xpath selector")
+
+        self.css = css
+        self.xpath = xpath
+        self.regex = regex
+        self.many = many
+        self.type = type
+        self.default = default
+        self.strip = strip
+        if isinstance(schema, dict):
+            schema = Schema(schema)
+        self.schema = schema
+
+        self._compile()
+
+    def _compile(self):
+        xpath = self.xpath
+        if self.css is not None:
+            xpath = css2xpath(self.css)
+        self._xpath = etree.XPath(xpath) if xpath is not None else None
+        self._regex = re.compile(self.regex) if self.regex is not None else None
+
+    def __getstate__(self):
+        # Compiled xpath objects can not be pickled, they are rebuilt in __setstate__
+        state = dict(self.__dict__)
+        del state['_xpath']
+        del state['_regex']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._compile()
+
+    @staticmethod
+    def _text(value):
+        if isinstance(value, str):
+            return value
+        if isinstance(value, float):
+            # Numbers from xpath functions like count()
+            return str(int(value)) if value.is_integer() else str(value)
+        if isinstance(value, bool):
+            return str(value)
+        return value.text_content()
+
+    def _convert(self, value):
+        if self.strip is True:
+            value = value.strip()
+        if self.type is not None:
+            try:
+                value = self.type(value)
+            except (TypeError, ValueError):
+                return self.default
+        return value
+
+    def extract(self, node):
+        if self._xpath is not None:
+            selected = self._xpath(node)
+            if not isinstance(selected, list):
+                # Xpath functions like count() or string() return a single value
+                selected = [selected]
+        else:
+            selected = [node]
+
+        if self.schema is not None:
+            values = [self.schema.extract_node(item) for item in selected if not isinstance(item, str)]
+        else:
+            values = []
+            for item in selected:
+                text = self._text(item)
+                if self._regex is None:
+                    values.append(self._convert(text))
+                    continue
+                for match in self._regex.finditer(text):
+                    values.append(self._convert(match.group(1) if self._regex.groups else match.group(0)))
+                    if self.many is False:
+                        break
+
+        if self.many is True:
+            return values
+        if values:
+            return values[0]
+        return self.default
+
+
+class Schema:
+    """
+    Compile a set of fields once and apply them to many pages
+
+        schema = Schema({'title': Field(css='h1::text'),
+                         'products': Field(css='div.product', many=True,
+                                           schema={'name': Field(css='a::text'),
+                                                   'price': Field(css='.price::text', regex=r'[\\d.]+', type=float)}),
+                         })
+        schema.extract(web.get_site(url))
+
+    Set `record=True` to get slotted record objects instead of dicts
+    """
+
+    def __init__(self, fields, record=False):
+        self.fields = fields
+        self.record = record
+        self._record_class = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_record_class'] = None
+        return state
+
+    @property
+    def record_class(self):
+        if self._record_class is None:
+            self._record_class = make_record_class(self.fields.keys())
+        return self._record_class
+
+    @staticmethod
+    def to_node(source):
+        """
+        Get an lxml node from anything get_site can return
+        """
+        if isinstance(source, Selector):
+            return source.root
+        if isinstance(source, etree._Element):
+            return source
+        if isinstance(source, (str, bytes)):
+            return lxml.html.fromstring(source)
+        # A BeautifulSoup object
+        return lxml.html.fromstring(str(source))
+
+    def extract_node(self, node):
+        return {name: field.extract(node) for name, field in self.fields.items()}
+
+    def _to_output(self, data):
+        if self.record is True:
+            return self.record_class(**data)
+        return data
+
+    def extract(self, source):
+        """
+        Extract the fields from a page (raw source, BeautifulSoup, parsel Selector or lxml node)
+        """
+        return self._to_output(self.extract_node(self.to_node(source)))
+
+    def extract_many(self, sources, processes=None, chunksize=16):
+        """
+        Extract the fields from a batch of raw pages
+        With `processes` set the pages are split across a pool of processes,
+        the schema is sent to each process once and compiled there
+        """
+        if not processes:
+            return [self.extract(source) for source in sources]
+
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(self,)) as executor:
+            results = list(executor.map(_extract_in_worker, sources, chunksize=chunksize))
+
+        return [self._to_output(data) if data is not None else None for data in results]
+
+
+def make_record_class(field_names, name='Record'):
+    """
+    Create a lightweight class with __slots__ for the field names
+    """
+    field_names = tuple(field_names)
+
+    def __init__(self, **kwargs):
+        for field_name in field_names:
+            setattr(self, field_name, kwargs.get(field_name))
+
+    def __repr__(self):
+        values = ', '.join('{}={!r}'.format(field_name, getattr(self, field_name)) for field_name in field_names)
+        return '{}({})'.format(name, values)
+
+    def to_dict(self):
+        return {field_name: getattr(self, field_name) for field_name in field_names}
+
+    return type(name, (), {'__slots__': field_names,
+                           '__init__': __init__,
+                           '__repr__': __repr__,
+                           'to_dict': to_dict,
+                           })
+
+
+##
+# Process pool helpers, need to be on the module level to be pickled
+##
+_worker_schema = None
+
+
+def _init_worker(schema):
+    global _worker_schema
+    _worker_schema = schema
+
+
+def _extract_in_worker(source):
+    try:
+        return _worker_schema.extract_node(Schema.to_node(source))
+    except Exception:
+        logger.exception("Failed to extract page")
+        return None
@@ -0,0 +1,224 @@
+import os
+import bisect
+import logging
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (.05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1024, 10 * 1024, 50 * 1024, 100 * 1024, 500 * 1024, 1024 * 1024, 5 * 1024 * 1024)
+PARSE_BUCKETS = (.001, .005, .01, .05, .1, .25, .5, 1, 2.5)
+
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = ['{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in pairs]
+    return '{' + ','.join(escaped) + '}'
+
+
+class Counter:
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        label_values = tuple(str(value) for value in label_values)
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def get(self, *label_values):
+        return self._values.get(tuple(str(value) for value in label_values), 0)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} counter'.format(self.name),
+                 ]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append('{}{} {}'.format(self.name, _format_labels(self.label_names, label_values), value))
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # label values -> [bucket counts..., sum, count]
+        self._values = {}
+
+    def observe(self, value, *label_values):
+        label_values = tuple(str(label_value) for label_value in label_values)
+        with self._lock:
+            data = self._values.get(label_values)
+            if data is None:
+                data = self._values[label_values] = [0] * (len(self.buckets) + 2)
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                data[index] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} histogram'.format(self.name),
+                 ]
+        with self._lock:
+            for label_values, data in sorted(self._values.items()):
+                cumulative = 0
+                for bucket, bucket_count in zip(self.buckets, data):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.label_names, label_values, extra=[('le', bucket)])
+                    lines.append('{}_bucket{} {}'.format(self.name, labels, cumulative))
+                labels = _format_labels(self.label_names, label_values, extra=[('le', '+Inf')])
+                lines.append('{}_bucket{} {}'.format(self.name, labels, data[-1]))
+                labels = _format_labels(self.label_names, label_values)
+                lines.append('{}_sum{} {}'.format(self.name, labels, data[-2]))
+                lines.append('{}_count{} {}'.format(self.name, labels, data[-1]))
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Prometheus/OpenMetrics style metrics for get_site
+    Attach to any number of drivers with `instrument(web)`, then expose the data with
+    `start_http_server()` or `write_textfile()` (for the node exporter textfile collector)
+    """
+
+    def __init__(self, prefix='web_wrapper'):
+        self.prefix = prefix
+        self._metrics = []
+        self._server = None
+
+        labels = ('driver', 'host')
+        self.requests = self.counter('requests_total', "Requests made by get_site", labels)
+        self.status_codes = self.counter('responses_total', "Responses by status code",
+                                         labels + ('status_code',))
+        self.retries = self.counter('retries_total', "Requests that were retried", labels + ('reason',))
+        self.profile_rotations = self.counter('profile_rotations_total', "Calls to new_profile()", ('driver',))
+        self.bytes = self.counter('response_bytes_total', "Size of the page sources returned", labels)
+        self.wire_bytes = self.counter('response_wire_bytes_total',
+                                       "Bytes received over the wire, before decompression", labels)
+        self.cache_hits = self.counter('cache_hits_total', "Responses served by the request coalescer", labels)
+        self.latency = self.histogram('request_seconds', "Time to fetch the page", labels, LATENCY_BUCKETS)
+        self.page_size = self.histogram('page_size_bytes', "Size of the page source", labels, SIZE_BUCKETS)
+        self.parse_time = self.histogram('parse_seconds', "Time to parse the page source", labels, PARSE_BUCKETS)
+
+    def counter(self, name, documentation, label_names=()):
+        metric = Counter('{}_{}'.format(self.prefix, name), documentation, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram('{}_{}'.format(self.prefix, name), documentation, label_names, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    ##
+    # Hooks
+    ##
+    def instrument(self, web):
+        """
+        Attach the metric hooks to a driver
+        """
+        web.add_hook('on_request', self._on_request)
+        web.add_hook('on_response', self._on_response)
+        web.add_hook('on_retry', self._on_retry)
+        web.add_hook('on_parse', self._on_parse)
+        web.add_hook('on_new_profile', self._on_new_profile)
+        return web
+
+    @staticmethod
+    def _labels(web, event):
+        return (web.driver_type, urllib.parse.urlsplit(event['url']).netloc)
+
+    def _on_request(self, web, event):
+        self.requests.inc(*self._labels(web, event))
+
+    def _on_response(self, web, event):
+        labels = self._labels(web, event)
+        self.status_codes.inc(*labels, event['status_code'])
+        if 'fetch' in event['timings']:
+            self.latency.observe(event['timings']['fetch'], *labels)
+        self.bytes.inc(*labels, amount=event['size'])
+        if int(event['status_code'] or 0) < 400:
+            # Error pages would skew the page sizes
+            self.page_size.observe(event['size'], *labels)
+        if event.get('transfer', {}).get('wire_bytes') is not None:
+            self.wire_bytes.inc(*labels, amount=event['transfer']['wire_bytes'])
+        if event.get('coalesced') is True:
+            self.cache_hits.inc(*labels)
+
+    def _on_retry(self, web, event):
+        self.retries.inc(*self._labels(web, event), event['reason'])
+
+    def _on_parse(self, web, event):
+        self.parse_time.observe(event['timings'].get('parse', 0), *self._labels(web, event))
+
+    def _on_new_profile(self, web, event):
+        self.profile_rotations.inc(web.driver_type)
+
+    ##
+    # Exporting
+    ##
+    def render(self):
+        """
+        Return all metrics in the Prometheus text format
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, save_path):
+        """
+        Write the metrics to a file, written to a tmp file first so readers never see half a file
+        """
+        tmp_path = '{}.{}.tmp'.format(save_path, os.getpid())
+        with open(tmp_path, 'w') as out_file:
+            out_file.write(self.render())
+        os.replace(tmp_path, save_path)
+        return save_path
+
+    def start_http_server(self, port=9464, host='127.0.0.1'):
+        """
+        Serve the metrics on http://host:port/metrics in a background thread
+        """
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = HTTPServer((host, port), MetricsHandler)
+        thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        thread.start()
+        logger.info("Serving metrics on http://{}:{}/metrics".format(host, self._server.server_port))
+        return self._server
+
+    def stop_http_server(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
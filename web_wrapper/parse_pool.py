@@ -0,0 +1,130 @@
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from parsel import Selector
+from bs4 import BeautifulSoup
+
+logger = logging.getLogger(__name__)
+
+
+class ParsePool:
+    """
+    Parse page sources in a pool of processes so parsing is not limited by the GIL
+
+    Pass into a driver as `parse_pool=` and get_site will return a Future of the parsed
+    result instead of parsing in the calling thread. Use `parse_callback=` in get_site to
+    run extraction in the worker as well, so only the (small) result is sent back.
+    The callback must be picklable (defined on the module level).
+
+    Bodies bigger then `shared_memory_threshold` bytes are handed over using shared memory
+    instead of being pickled through the pipe
+    """
+
+    def __init__(self, processes=None, shared_memory_threshold=256 * 1024):
+        self.shared_memory_threshold = shared_memory_threshold
+        self.executor = ProcessPoolExecutor(max_workers=processes)
+
+    def submit(self, raw, page_format='html', parser='beautifulsoup', callback=None, encoding=None):
+        """
+        Parse `raw` (bytes or str) in the pool, returns a concurrent.futures.Future
+        """
+        if isinstance(raw, str):
+            raw = raw.encode('utf-8')
+            encoding = 'utf-8'
+
+        if len(raw) < self.shared_memory_threshold:
+            return self.executor.submit(_parse, raw, page_format, parser, callback, encoding)
+
+        shm = shared_memory.SharedMemory(create=True, size=len(raw))
+        shm.buf[:len(raw)] = raw
+        future = self.executor.submit(_parse_shared, shm.name, len(raw), page_format, parser, callback, encoding)
+        future.add_done_callback(lambda _: _release(shm))
+        return future
+
+    def map(self, raws, page_format='html', parser='beautifulsoup', callback=None, encoding=None):
+        """
+        Parse every source, yielding the results in the same order
+        """
+        futures = [self.submit(raw, page_format=page_format, parser=parser, callback=callback, encoding=encoding)
+                   for raw in raws]
+        for future in futures:
+            yield future.result()
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+
+def _release(shm):
+    try:
+        shm.close()
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def parse_raw(raw, page_format='html', parser='beautifulsoup', encoding=None):
+    """
+    Same as Web.parse_source, but works on bytes (or already decoded text) without needing a driver
+    """
+    if isinstance(raw, str):
+        encoding = None
+
+    if page_format == 'html':
+        if parser == 'beautifulsoup':
+            return BeautifulSoup(raw, 'html.parser', from_encoding=encoding)
+        elif parser == 'parsel':
+            if isinstance(raw, str):
+                return Selector(text=raw)
+            return Selector(body=raw, encoding=encoding or 'utf-8')
+        logger.error("No parser passed for parsing html")
+        return None
+
+    elif page_format == 'json':
+        if isinstance(raw, str):
+            return json.loads(raw)
+        return json.loads(raw.decode(encoding or 'utf-8'))
+
+    elif page_format == 'xml':
+        return BeautifulSoup(raw, 'lxml', from_encoding=encoding)
+
+    elif page_format == 'raw':
+        if isinstance(raw, str):
+            return raw
+        return raw.decode(encoding or 'utf-8', errors='replace')
+
+    return None
+
+
+def _parse(raw, page_format, parser, callback, encoding):
+    rdata = parse_raw(raw, page_format=page_format, parser=parser, encoding=encoding)
+    if callback is not None:
+        return callback(rdata)
+    return rdata
+
+
+def _parse_shared(name, size, page_format, parser, callback, encoding):
+    try:
+        # Do not let this process' resource tracker remove the block, the parent owns it
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # python < 3.13 always tracks it, the pool shares the parent's tracker which already has it
+        shm = shared_memory.SharedMemory(name=name)
+
+    try:
+        if encoding is not None:
+            # Decode straight out of the shared memory instead of copying the bytes out first
+            raw = str(shm.buf[:size], encoding, errors='replace')
+        else:
+            # Let the parser detect the encoding
+            raw = bytes(shm.buf[:size])
+    finally:
+        shm.close()
+
+    return _parse(raw, page_format, parser, callback, encoding)
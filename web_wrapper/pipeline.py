@@ -0,0 +1,205 @@
+import queue
+import asyncio
+import logging
+import threading
+from web_wrapper.result import free_soup
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class _InputsDone:
+
+    def __init__(self, count, error=None):
+        self.count = count
+        self.error = error
+
+
+class _WorkerFailed:
+
+    def __init__(self, error):
+        self.error = error
+
+
+class PipelineResult:
+    """
+    Result for a single input
+    `value` is the output of the last stage, `error` is set if any stage raised
+    """
+    __slots__ = ('index', 'input', 'url', 'value', 'error', 'status_code')
+
+    def __init__(self, index, input, url):
+        self.index = index
+        self.input = input
+        self.url = url
+        self.value = None
+        self.error = None
+        self.status_code = None
+
+    def __repr__(self):
+        return 'PipelineResult(index={}, url={!r}, status_code={}, error={!r})'.format(
+            self.index, self.url, self.status_code, self.error)
+
+
+class Pipeline:
+    """
+    Stream any number of urls through get_site using a fixed number of worker threads
+
+    Inputs can be urls or dicts of get_site kwargs (must include `url`), from any iterable
+    or async iterable. Inputs are only read as fast as results are consumed, at most
+    `max_in_flight` inputs are being worked on or waiting to be consumed, so memory stays
+    flat no matter how many inputs there are.
+
+    Each page is fetched, checked & parsed by get_site, then passed through `stages` in order.
+    A stage is `func(web, value)` and returns the new value (e.g. extraction).
+    With `ordered=True` results are yielded in input order, else as they complete.
+    If `web_factory` raises in every worker, the error is raised from `run`.
+    If the driver has `decompose_soup=True` the page is decomposed after the last stage,
+    so stages have to return plain data and not parts of the soup.
+    """
+
+    def __init__(self, web_factory, workers=4, max_in_flight=None, ordered=False, stages=[], get_site_kwargs={},
+                 quit_drivers=True):
+        self.web_factory = web_factory
+        self.workers = workers
+        self.max_in_flight = max_in_flight or workers * 4
+        self.ordered = ordered
+        self.stages = stages
+        self.get_site_kwargs = get_site_kwargs
+        self.quit_drivers = quit_drivers
+
+    def _process(self, web, index, item):
+        if isinstance(item, dict):
+            kwargs = dict(self.get_site_kwargs)
+            kwargs.update(item)
+            url = kwargs.pop('url')
+        else:
+            kwargs = self.get_site_kwargs
+            url = item
+
+        result = PipelineResult(index, item, url)
+        try:
+            page = value = web.get_site(url, **kwargs)
+            result.status_code = web.status_code
+            for stage in self.stages:
+                if value is None:
+                    break
+                value = stage(web, value)
+            result.value = value
+            if getattr(web, 'decompose_soup', False) is True and value is not page:
+                # The stages are done with the soup
+                free_soup(page)
+        except Exception as e:
+            result.error = e
+        return result
+
+    def _produce(self, inputs, in_queue, out_queue, slots, stop):
+        count = 0
+
+        def put(item):
+            # Wait for a free slot, this is the backpressure on the inputs
+            while not slots.acquire(timeout=0.1):
+                if stop.is_set():
+                    return False
+            in_queue.put((count, item))
+            return True
+
+        error = None
+        try:
+            if hasattr(inputs, '__aiter__'):
+                async def drain():
+                    nonlocal count
+                    async for item in inputs:
+                        if put(item) is False:
+                            return
+                        count += 1
+                asyncio.run(drain())
+            else:
+                for item in inputs:
+                    if put(item) is False:
+                        break
+                    count += 1
+        except Exception as e:
+            logger.exception("Failed reading the pipeline inputs")
+            error = e
+
+        for _ in range(self.workers):
+            in_queue.put(_STOP)
+        out_queue.put(_InputsDone(count, error))
+
+    def _work(self, in_queue, out_queue):
+        try:
+            web = self.web_factory()
+        except Exception as e:
+            logger.exception("Failed to create the pipeline driver")
+            out_queue.put(_WorkerFailed(e))
+            return
+
+        try:
+            while True:
+                item = in_queue.get()
+                if item is _STOP:
+                    break
+                out_queue.put(self._process(web, *item))
+        finally:
+            if self.quit_drivers is True:
+                try:
+                    web.quit()
+                except Exception:
+                    logger.exception("Failed to quit the pipeline driver")
+
+    def run(self, inputs):
+        """
+        Generator of PipelineResult for each input
+        """
+        in_queue = queue.Queue()
+        out_queue = queue.Queue()
+        slots = threading.Semaphore(self.max_in_flight)
+        stop = threading.Event()
+
+        threading.Thread(target=self._produce, args=(inputs, in_queue, out_queue, slots, stop), daemon=True).start()
+        for _ in range(self.workers):
+            threading.Thread(target=self._work, args=(in_queue, out_queue), daemon=True).start()
+
+        total = None
+        input_error = None
+        failed_workers = 0
+        yielded = 0
+        next_index = 0
+        # Holds results that finished before the ones ahead of them, never bigger then max_in_flight
+        reorder_buffer = {}
+        try:
+            while total is None or yielded < total:
+                message = out_queue.get()
+                if isinstance(message, _InputsDone):
+                    total = message.count
+                    input_error = message.error
+                    continue
+
+                if isinstance(message, _WorkerFailed):
+                    failed_workers += 1
+                    if failed_workers == self.workers:
+                        # Nothing is left to work on the inputs
+                        raise message.error
+                    continue
+
+                if self.ordered is False:
+                    slots.release()
+                    yielded += 1
+                    yield message
+                    continue
+
+                reorder_buffer[message.index] = message
+                while next_index in reorder_buffer:
+                    result = reorder_buffer.pop(next_index)
+                    next_index += 1
+                    slots.release()
+                    yielded += 1
+                    yield result
+
+            if input_error is not None:
+                raise input_error
+        finally:
+            # Stops the producer if the consumer stopped early, workers exit once the inputs are done
+            stop.set()
@@ -0,0 +1,479 @@
+import os
+import time
+import pickle
+import queue
+import logging
+import threading
+import multiprocessing
+import urllib.parse
+from collections import OrderedDict
+from multiprocessing.managers import BaseManager
+from web_wrapper.pipeline import Pipeline, PipelineResult
+from web_wrapper.proxy_pool import ProxyPool
+from web_wrapper.circuit_breaker import CircuitBreaker
+from web_wrapper.request_coalescer import RequestCoalescer
+
+logger = logging.getLogger(__name__)
+
+_STOP = None
+# Messages from the workers, `(_CLAIM, worker_id, index)` when an input is picked up
+# and `(_DONE, worker_id)` when the worker exits. Results are sent as pickled bytes
+_CLAIM = 'claim'
+_DONE = 'done'
+
+# Status codes that mean the host wants everyone to slow down
+BACKOFF_STATUS_CODES = (429, 503)
+
+
+class HostRateLimiter:
+    """
+    Spaces out requests to each host by at least `min_interval` seconds across every worker
+    When a host pushes back (429/503) every worker stops sending it requests for `backoff`
+    seconds, doubling each time it happens again (up to `max_backoff`)
+    """
+
+    def __init__(self, min_interval=0, backoff=5, max_backoff=300):
+        self.min_interval = min_interval
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self._lock = threading.Lock()
+        # host -> time the next request is allowed
+        self._next_request = {}
+        # host -> number of times in a row it pushed back
+        self._strikes = {}
+        self._waited = 0
+
+    def reserve(self, host):
+        """
+        Reserve the next slot for the host, returns how long to sleep before using it
+        """
+        with self._lock:
+            now = time.time()
+            request_time = max(now, self._next_request.get(host, 0))
+            self._next_request[host] = request_time + self.min_interval
+            self._waited += request_time - now
+            return request_time - now
+
+    def penalize(self, host):
+        with self._lock:
+            strikes = self._strikes.get(host, 0) + 1
+            self._strikes[host] = strikes
+            delay = min(self.max_backoff, self.backoff * 2 ** (strikes - 1))
+            self._next_request[host] = max(self._next_request.get(host, 0), time.time() + delay)
+            logger.info("Backing off {} for {}s".format(host, delay))
+            return delay
+
+    def succeed(self, host):
+        with self._lock:
+            self._strikes.pop(host, None)
+
+    def stats(self):
+        with self._lock:
+            return {'hosts': len(self._next_request),
+                    'backing_off': len(self._strikes),
+                    'waited': self._waited,
+                    }
+
+
+class ResponseCache:
+    """
+    LRU cache of (source_text, status_code, url) with a TTL, lives in the coordinator
+    """
+
+    def __init__(self, max_size=1000, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._cache.get(key)
+            if item is None or item[0] < time.time():
+                self._cache.pop(key, None)
+                self._misses += 1
+                return None
+
+            self._cache.move_to_end(key)
+            self._hits += 1
+            return item[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._cache[key] = (time.time() + self.ttl, value)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._cache),
+                    'hits': self._hits,
+                    'misses': self._misses,
+                    }
+
+
+class ThroughputStats:
+    """
+    Request counters from every worker process
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start = time.time()
+        self._workers = {}
+
+    def _get_worker(self, pid):
+        worker = self._workers.get(pid)
+        if worker is None:
+            worker = self._workers[pid] = {'requests': 0,
+                                           'responses': 0,
+                                           'retries': 0,
+                                           'rotations': 0,
+                                           'bytes': 0,
+                                           'fetch_time': 0,
+                                           }
+        return worker
+
+    def record(self, pid, **counts):
+        with self._lock:
+            worker = self._get_worker(pid)
+            for key, amount in counts.items():
+                worker[key] += amount
+
+    def summary(self):
+        with self._lock:
+            elapsed = max(time.time() - self._start, 1e-9)
+            totals = {'requests': 0, 'responses': 0, 'retries': 0, 'rotations': 0, 'bytes': 0, 'fetch_time': 0}
+            for worker in self._workers.values():
+                for key in totals:
+                    totals[key] += worker[key]
+
+            totals['elapsed'] = elapsed
+            totals['pages_per_second'] = totals['responses'] / elapsed
+            totals['bytes_per_second'] = totals['bytes'] / elapsed
+            totals['avg_fetch_time'] = totals['fetch_time'] / totals['responses'] if totals['responses'] else None
+            totals['workers'] = {pid: dict(worker) for pid, worker in self._workers.items()}
+            return totals
+
+
+class Coordinator(BaseManager):
+    """
+    Local server process that holds the state shared by the workers
+    Listens on a unix socket by default
+    """
+
+
+Coordinator.register('HostRateLimiter', HostRateLimiter)
+Coordinator.register('ResponseCache', ResponseCache)
+Coordinator.register('ThroughputStats', ThroughputStats)
+Coordinator.register('ProxyPool', ProxyPool)
+Coordinator.register('CircuitBreaker', CircuitBreaker)
+
+
+class SharedResponseCache:
+    """
+    Used as the `request_coalescer` of the drivers in a worker
+    Requests in the same process are still coalesced, the cache is shared by every process
+    """
+
+    make_key = staticmethod(RequestCoalescer.make_key)
+
+    def __init__(self, cache):
+        self.cache = cache
+        self._coalescer = RequestCoalescer()
+
+    def fetch(self, key, fetch_func):
+        def cached_fetch():
+            value = self.cache.get(key)
+            if value is not None:
+                return value
+            source_text, status_code, url, response = fetch_func()
+            # The response object stays in this process
+            self.cache.set(key, (source_text, status_code, url, None))
+            return source_text, status_code, url, response
+
+        return self._coalescer.fetch(key, cached_fetch)
+
+    def stats(self):
+        return self._coalescer.stats()
+
+
+def _instrument(web, rate_limiter, stats):
+    """
+    Hooks so the worker drivers follow the shared rate limits and report their counts
+    """
+    pid = os.getpid()
+
+    def get_host(event):
+        return urllib.parse.urlsplit(event['url']).netloc.lower()
+
+    def on_request(web, event):
+        delay = rate_limiter.reserve(get_host(event))
+        if delay > 0:
+            time.sleep(delay)
+        stats.record(pid, requests=1)
+
+    def on_response(web, event):
+        if event['status_code'] is not None and event['status_code'] < 400:
+            rate_limiter.succeed(get_host(event))
+        stats.record(pid, responses=1, bytes=event['size'], fetch_time=event['timings'].get('fetch', 0))
+
+    def on_retry(web, event):
+        if event['reason'] in BACKOFF_STATUS_CODES:
+            rate_limiter.penalize(get_host(event))
+        stats.record(pid, retries=1)
+
+    def on_new_profile(web, event):
+        stats.record(pid, rotations=1)
+
+    web.add_hook('on_request', on_request)
+    web.add_hook('on_response', on_response)
+    web.add_hook('on_retry', on_retry)
+    web.add_hook('on_new_profile', on_new_profile)
+    return web
+
+
+def _read_inputs(in_queue, out_queue, worker_id, indexes):
+    count = 0
+    while True:
+        item = in_queue.get()
+        if item is _STOP:
+            return
+        indexes[count], item = item
+        # So the runner knows which inputs are lost if this worker dies
+        out_queue.put((_CLAIM, worker_id, indexes[count]))
+        count += 1
+        yield item
+
+
+def _worker_main(worker_id, in_queue, out_queue, web_factory, shared, rate_limiter, stats, threads, stages,
+                 get_site_kwargs):
+    if shared.get('request_coalescer') is not None:
+        shared['request_coalescer'] = SharedResponseCache(shared['request_coalescer'])
+
+    def make_web():
+        return _instrument(web_factory(**shared), rate_limiter, stats)
+
+    # Index in this worker -> index in the inputs of the runner
+    indexes = {}
+    pipeline = Pipeline(make_web, workers=threads, max_in_flight=threads * 2, stages=stages,
+                        get_site_kwargs=get_site_kwargs)
+    try:
+        for result in pipeline.run(_read_inputs(in_queue, out_queue, worker_id, indexes)):
+            result.index = indexes.pop(result.index)
+            try:
+                out_queue.put(pickle.dumps(result))
+            except Exception as e:
+                logger.warning("Could not send the result for {} back, stages should return plain data"
+                               .format(result.url))
+                result.value = None
+                result.error = RuntimeError("Result could not be pickled: {!r}".format(e))
+                out_queue.put(pickle.dumps(result))
+    except Exception:
+        logger.exception("Runner worker failed")
+    finally:
+        # Always let the runner know this worker is done
+        out_queue.put((_DONE, worker_id))
+
+
+class ProcessRunner:
+    """
+    Run get_site over many urls using `processes` worker processes with `threads` drivers each
+
+    The workers share their state through a local coordinator process:
+        - per host rate limits and backoff (`host_interval`, `backoff`, `max_backoff`)
+        - proxy health, if `proxy_pool_kwargs` is set (ProxyPool arguments)
+        - host circuits, if `circuit_breaker_kwargs` is set (CircuitBreaker arguments)
+        - a response cache, if `cache_size` is more then 0
+
+    `web_factory(**shared)` must create a driver and be picklable (a module level function or
+    a functools.partial of a driver class). It is passed the shared `proxy_pool`,
+    `circuit_breaker` and `request_coalescer` that are enabled.
+    Results are PipelineResult's (see Pipeline), stage outputs have to be picklable.
+    If a worker exits before finishing the inputs it picked up, those inputs are yielded
+    with a RuntimeError as their `error`.
+    """
+
+    def __init__(self, web_factory, processes=4, threads=1, max_in_flight=None, ordered=False, stages=[],
+                 get_site_kwargs={}, host_interval=0, backoff=5, max_backoff=300, proxy_pool_kwargs=None,
+                 circuit_breaker_kwargs=None, cache_size=0, cache_ttl=60, address=None, mp_context=None):
+        self.web_factory = web_factory
+        self.processes = processes
+        self.threads = threads
+        self.max_in_flight = max_in_flight or processes * threads * 4
+        self.ordered = ordered
+        self.stages = stages
+        self.get_site_kwargs = get_site_kwargs
+        self.host_interval = host_interval
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.proxy_pool_kwargs = proxy_pool_kwargs
+        self.circuit_breaker_kwargs = circuit_breaker_kwargs
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.address = address
+
+        self._context = multiprocessing.get_context(mp_context)
+        self.coordinator = None
+        self._last_stats = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def start(self):
+        if self.coordinator is not None:
+            return
+
+        self.coordinator = Coordinator(address=self.address, ctx=self._context)
+        self.coordinator.start()
+        self.rate_limiter = self.coordinator.HostRateLimiter(self.host_interval, self.backoff, self.max_backoff)
+        self.throughput = self.coordinator.ThroughputStats()
+
+        self.shared = {}
+        if self.proxy_pool_kwargs is not None:
+            self.shared['proxy_pool'] = self.coordinator.ProxyPool(**self.proxy_pool_kwargs)
+        if self.circuit_breaker_kwargs is not None:
+            self.shared['circuit_breaker'] = self.coordinator.CircuitBreaker(**self.circuit_breaker_kwargs)
+        if self.cache_size > 0:
+            self.shared['request_coalescer'] = self.coordinator.ResponseCache(self.cache_size, self.cache_ttl)
+
+    def close(self):
+        if self.coordinator is None:
+            return
+
+        self._last_stats = self.stats()
+        self.coordinator.shutdown()
+        self.coordinator = None
+
+    def stats(self):
+        """
+        Aggregate throughput of every worker, plus the state of the shared objects
+        """
+        if self.coordinator is None:
+            return self._last_stats
+
+        stats = self.throughput.summary()
+        stats['rate_limiter'] = self.rate_limiter.stats()
+        if 'request_coalescer' in self.shared:
+            stats['cache'] = self.shared['request_coalescer'].stats()
+        if 'proxy_pool' in self.shared:
+            stats['proxies'] = self.shared['proxy_pool'].stats()
+        return stats
+
+    def _produce(self, inputs, in_queue, out_queue, slots, stop, sent):
+        count = 0
+        try:
+            for item in inputs:
+                # Wait for a free slot, this is the backpressure on the inputs
+                while not slots.acquire(timeout=0.1):
+                    if stop.is_set():
+                        break
+                if stop.is_set():
+                    break
+                sent[count] = item
+                in_queue.put((count, item))
+                count += 1
+        except Exception:
+            logger.exception("Failed reading the runner inputs")
+
+        for _ in range(self.processes):
+            in_queue.put(_STOP)
+
+    def run(self, inputs):
+        """
+        Generator of PipelineResult for each input
+        """
+        self.start()
+
+        in_queue = self._context.Queue()
+        out_queue = self._context.Queue()
+        slots = threading.Semaphore(self.max_in_flight)
+        stop = threading.Event()
+
+        workers = []
+        for worker_id in range(self.processes):
+            worker = self._context.Process(target=_worker_main,
+                                           args=(worker_id, in_queue, out_queue, self.web_factory, self.shared,
+                                                 self.rate_limiter, self.throughput, self.threads,
+                                                 self.stages, self.get_site_kwargs),
+                                           daemon=True)
+            worker.start()
+            workers.append(worker)
+
+        # index -> input, for every input sent to the workers that has no result yet
+        sent = {}
+        threading.Thread(target=self._produce, args=(inputs, in_queue, out_queue, slots, stop, sent),
+                         daemon=True).start()
+
+        # worker id -> indexes it picked up that have no result yet
+        claimed = {worker_id: set() for worker_id in range(len(workers))}
+        running = set(claimed)
+        next_index = 0
+        # Holds results that finished before the ones ahead of them, never bigger then max_in_flight
+        reorder_buffer = {}
+
+        def lost_results(indexes):
+            for index in sorted(indexes):
+                item = sent.pop(index, None)
+                result = PipelineResult(index, item, item.get('url') if isinstance(item, dict) else item)
+                result.error = RuntimeError("Runner worker exited before finishing this input")
+                yield result
+
+        try:
+            while running:
+                results = []
+                try:
+                    message = out_queue.get(timeout=1)
+                except queue.Empty:
+                    for worker_id in list(running):
+                        if not workers[worker_id].is_alive():
+                            logger.error("Runner worker {} exited with code {}"
+                                         .format(worker_id, workers[worker_id].exitcode))
+                            running.discard(worker_id)
+                            results.extend(lost_results(claimed.pop(worker_id)))
+                else:
+                    if isinstance(message, tuple) and message[0] == _CLAIM:
+                        claimed[message[1]].add(message[2])
+                        continue
+                    if isinstance(message, tuple) and message[0] == _DONE:
+                        running.discard(message[1])
+                        results.extend(lost_results(claimed.pop(message[1])))
+                    else:
+                        result = pickle.loads(message)
+                        sent.pop(result.index, None)
+                        for indexes in claimed.values():
+                            indexes.discard(result.index)
+                        results.append(result)
+
+                if not running:
+                    # Inputs no worker ever picked up
+                    results.extend(lost_results(list(sent)))
+
+                for result in results:
+                    if self.ordered is False:
+                        slots.release()
+                        yield result
+                        continue
+
+                    reorder_buffer[result.index] = result
+                    while next_index in reorder_buffer:
+                        result = reorder_buffer.pop(next_index)
+                        next_index += 1
+                        slots.release()
+                        yield result
+        finally:
+            stop.set()
+            if running:
+                for worker in workers:
+                    worker.terminate()
+            for worker in workers:
+                worker.join()
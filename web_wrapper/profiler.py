@@ -0,0 +1,260 @@
+import os
+import sys
+import json
+import time
+import logging
+import weakref
+import threading
+import tracemalloc
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Set to a directory to profile every driver that gets created
+PROFILE_ENV = 'WEB_WRAPPER_PROFILE'
+
+# Stage name -> method on the Web instance that runs that stage
+STAGES = (('fetch', '_fetch_site'),
+          ('checks', '_run_source_checks'),
+          ('parse', 'parse_source'),
+          )
+
+_MISSING = object()
+
+
+class _Sampler:
+    """
+    A single thread that samples the stacks for every running Profiler in the process
+    Only polls while a profiled thread is inside a stage
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._profilers = weakref.WeakSet()
+        self._thread = None
+        # Set when a thread enters a stage
+        self.wakeup = threading.Event()
+
+    def add(self, profiler):
+        with self._lock:
+            self._profilers.add(profiler)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def remove(self, profiler):
+        with self._lock:
+            self._profilers.discard(profiler)
+
+    def _run(self):
+        while True:
+            self.wakeup.clear()
+            with self._lock:
+                if not self._profilers:
+                    self._thread = None
+                    return
+                active = [profiler for profiler in self._profilers if profiler._active]
+
+            if not active:
+                self.wakeup.wait(1)
+                continue
+
+            frames = sys._current_frames()
+            for profiler in active:
+                profiler._sample(frames)
+            interval = min(profiler.interval for profiler in active)
+            # Do not keep the profilers alive while sleeping
+            del active, frames
+            time.sleep(interval)
+
+
+_sampler = _Sampler()
+
+
+class Profiler:
+    """
+    Profile the get_site pipeline of a driver
+    While running, the stacks of threads inside a stage are sampled every `interval` seconds,
+    and the time and memory allocated (using tracemalloc) in each stage is tracked.
+
+        with web.profile('profile_output'):
+            web.get_site(url)
+
+    Writes `profile.collapsed` (for flamegraph.pl/speedscope) and `profile_summary.json`
+    Memory numbers are for the whole process, so other threads can add to them (and a stage
+    starting in another thread resets the peak)
+    """
+
+    def __init__(self, web, output_dir='.', interval=0.005, trace_memory=True):
+        # Weak so a profiler never keeps its driver alive
+        self._web = weakref.ref(web)
+        self.output_dir = output_dir
+        self.interval = interval
+        self.trace_memory = trace_memory
+
+        self.stacks = Counter()
+        self.stages = {stage: {'calls': 0, 'time': 0, 'allocated': 0, 'peak': 0} for stage, _ in STAGES}
+
+        self._lock = threading.Lock()
+        # thread id -> stage that thread is in
+        self._active = {}
+        # thread id -> peak memory of each stage that thread is in, from outer to inner
+        self._peaks = {}
+        self._running = False
+        # Methods that were set on the instance before start(), put back by stop()
+        self._saved_methods = {}
+        self._started_tracemalloc = False
+
+    @property
+    def web(self):
+        return self._web()
+
+    def _wrap(self, stage, func):
+        def wrapper(*args, **kwargs):
+            thread_id = threading.get_ident()
+            outer_stage = self._active.get(thread_id)
+            self._active[thread_id] = stage
+            _sampler.wakeup.set()
+
+            if self.trace_memory is True:
+                memory_start, outer_peak = tracemalloc.get_traced_memory()
+                # So the peak is only for this stage, not anything that ran before it
+                tracemalloc.reset_peak()
+                peaks = self._peaks.setdefault(thread_id, [])
+                if peaks:
+                    # Keep the outer stage's peak up to now, it is reset along with this one
+                    peaks[-1] = max(peaks[-1], outer_peak)
+                peaks.append(0)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                duration = time.perf_counter() - start
+                if self.trace_memory is True:
+                    memory_now, memory_peak = tracemalloc.get_traced_memory()
+                    # Include the peaks of any stages nested in this one
+                    memory_peak = max(memory_peak, peaks.pop())
+                    if peaks:
+                        peaks[-1] = max(peaks[-1], memory_peak)
+                    else:
+                        del self._peaks[thread_id]
+
+                if outer_stage is None:
+                    del self._active[thread_id]
+                else:
+                    self._active[thread_id] = outer_stage
+
+                with self._lock:
+                    stage_data = self.stages[stage]
+                    stage_data['calls'] += 1
+                    stage_data['time'] += duration
+                    if self.trace_memory is True:
+                        stage_data['allocated'] += max(0, memory_now - memory_start)
+                        stage_data['peak'] = max(stage_data['peak'], memory_peak - memory_start)
+
+        return wrapper
+
+    def _sample(self, frames):
+        for thread_id, stage in list(self._active.items()):
+            frame = frames.get(thread_id)
+            if frame is None:
+                continue
+
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), frame.f_lineno))
+                frame = frame.f_back
+            stack.append(stage)
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        if self.trace_memory is True and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+        web = self.web
+        for stage, method_name in STAGES:
+            self._saved_methods[method_name] = web.__dict__.get(method_name, _MISSING)
+            # Set on the instance so only this driver is profiled
+            setattr(web, method_name, self._wrap(stage, getattr(web, method_name)))
+
+        self._running = True
+        _sampler.add(self)
+        return self
+
+    def stop(self):
+        if self._running is False:
+            return
+
+        self._running = False
+        _sampler.remove(self)
+
+        web = self.web
+        if web is not None:
+            for method_name, method in self._saved_methods.items():
+                if method is _MISSING:
+                    # Falls back to the class method
+                    web.__dict__.pop(method_name, None)
+                else:
+                    setattr(web, method_name, method)
+        self._saved_methods = {}
+
+        if self._started_tracemalloc is True:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def summary(self):
+        total_time = sum(stage_data['time'] for stage_data in self.stages.values()) or 1
+        summary = {}
+        for stage, stage_data in self.stages.items():
+            summary[stage] = dict(stage_data)
+            summary[stage]['time_percent'] = stage_data['time'] / total_time * 100
+            summary[stage]['avg_time'] = stage_data['time'] / stage_data['calls'] if stage_data['calls'] else 0
+        return summary
+
+    def save(self):
+        """
+        Write the collapsed stacks and per stage summary to `output_dir`
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        collapsed_path = os.path.join(self.output_dir, 'profile.collapsed')
+        with open(collapsed_path, 'w') as out_file:
+            for stack, count in self.stacks.most_common():
+                out_file.write('{} {}\n'.format(stack, count))
+
+        summary_path = os.path.join(self.output_dir, 'profile_summary.json')
+        with open(summary_path, 'w') as out_file:
+            json.dump(self.summary(), out_file, indent=2)
+
+        for stage, stage_data in self.summary().items():
+            logger.info("Profile {}: {} calls, {:.3f}s ({:.1f}%), {:.1f}KB allocated"
+                        .format(stage, stage_data['calls'], stage_data['time'], stage_data['time_percent'],
+                                stage_data['allocated'] / 1024))
+
+        return collapsed_path, summary_path
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+        self.save()
+
+
+def profile_from_env(web):
+    """
+    Start profiling `web` if the env var is set
+    Results are saved when the driver is garbage collected or python exits, whichever is first
+    """
+    output_dir = os.environ.get(PROFILE_ENV)
+    if not output_dir:
+        return None
+
+    # Each driver gets its own dir so they do not overwrite each other
+    output_dir = os.path.join(output_dir, '{}_{}_{}'.format(type(web).__name__, os.getpid(), id(web)))
+    profiler = Profiler(web, output_dir=output_dir).start()
+    # finalize shares one atexit hook for every driver and only holds the driver weakly
+    weakref.finalize(web, profiler.save)
+    return profiler
@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class ProxyStats:
+    """
+    Health data for a single proxy
+    """
+
+    def __init__(self, proxy, max_samples=100):
+        self.proxy = proxy
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.quarantined_until = 0
+        self.latencies = deque(maxlen=max_samples)
+        self.recent_errors = deque(maxlen=10)
+
+    @property
+    def success_rate(self):
+        """
+        Smoothed so a new proxy starts out as healthy and one bad request does not kill it
+        """
+        return (self.successes + 1) / (self.successes + self.failures + 2)
+
+    def latency_percentile(self, percent):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    @property
+    def p50(self):
+        return self.latency_percentile(50)
+
+    @property
+    def p95(self):
+        return self.latency_percentile(95)
+
+    def is_quarantined(self, now=None):
+        if now is None:
+            now = time.time()
+        return self.quarantined_until > now
+
+    def to_dict(self):
+        return {'proxy': self.proxy,
+                'successes': self.successes,
+                'failures': self.failures,
+                'consecutive_failures': self.consecutive_failures,
+                'quarantined_until': self.quarantined_until,
+                'latencies': list(self.latencies),
+                'recent_errors': list(self.recent_errors),
+                'success_rate': self.success_rate,
+                'p50': self.p50,
+                'p95': self.p95,
+                }
+
+    @classmethod
+    def from_dict(cls, data, max_samples=100):
+        stats = cls(data['proxy'], max_samples=max_samples)
+        stats.successes = data.get('successes', 0)
+        stats.failures = data.get('failures', 0)
+        stats.consecutive_failures = data.get('consecutive_failures', 0)
+        stats.quarantined_until = data.get('quarantined_until', 0)
+        stats.latencies.extend(data.get('latencies', []))
+        stats.recent_errors.extend(data.get('recent_errors', []))
+        return stats
+
+
+class ProxyPool:
+    """
+    Pick proxies based on how well they have been doing
+    Fast healthy proxies get picked more often, proxies that keep failing are
+    put in quarantine for `cooldown` seconds
+    Only errors the proxy is likely the cause of count against it: connection errors, timeouts
+    and the status codes in `proxy_status_codes` (auth, blocked & rate limited)
+
+    Pass into any driver as `proxy_pool=` and it will be used by `new_proxy()`
+    """
+
+    def __init__(self, proxies=[], save_file=None, quarantine_after=3, cooldown=300, max_samples=100,
+                 proxy_status_codes=(403, 407, 429)):
+        self.save_file = save_file
+        self.proxy_status_codes = set(proxy_status_codes)
+        self.quarantine_after = quarantine_after
+        self.cooldown = cooldown
+        self.max_samples = max_samples
+
+        self._lock = threading.Lock()
+        self._proxies = {}
+
+        if self.save_file is not None and os.path.isfile(self.save_file):
+            self.load(self.save_file)
+
+        for proxy in proxies:
+            self.add_proxy(proxy)
+
+    def add_proxy(self, proxy):
+        with self._lock:
+            if proxy not in self._proxies:
+                self._proxies[proxy] = ProxyStats(proxy, max_samples=self.max_samples)
+
+    def remove_proxy(self, proxy):
+        with self._lock:
+            self._proxies.pop(proxy, None)
+
+    def _weight(self, stats):
+        """
+        Higher is better, healthy proxies with a low median latency win
+        """
+        latency = stats.p50
+        if latency is None:
+            # No data yet, give it an average chance so it gets tried
+            latency = 1.0
+        return stats.success_rate ** 2 / max(latency, 0.01)
+
+    def get_proxy(self):
+        """
+        Return a proxy using weighted random selection
+        If every proxy is quarantined the one closest to getting out is returned
+        """
+        with self._lock:
+            if not self._proxies:
+                return None
+
+            now = time.time()
+            candidates = [stats for stats in self._proxies.values() if not stats.is_quarantined(now)]
+            if not candidates:
+                logger.warning("All proxies are quarantined, using the one with the shortest cooldown left")
+                return min(self._proxies.values(), key=lambda stats: stats.quarantined_until).proxy
+
+            weights = [self._weight(stats) for stats in candidates]
+            return random.choices(candidates, weights=weights)[0].proxy
+
+    def report(self, proxy, latency=None, error=None):
+        """
+        Record the result of a request made using `proxy`
+        `error` is None on success, otherwise the status code or exception name
+        Any other status code (like a 404) means the proxy did its job
+        """
+        if proxy is None:
+            return
+
+        if error is not None and str(error).isdigit() and int(error) not in self.proxy_status_codes:
+            error = None
+
+        with self._lock:
+            stats = self._proxies.get(proxy)
+            if stats is None:
+                stats = self._proxies[proxy] = ProxyStats(proxy, max_samples=self.max_samples)
+
+            if error is None:
+                stats.successes += 1
+                stats.consecutive_failures = 0
+                if latency is not None:
+                    stats.latencies.append(latency)
+            else:
+                stats.failures += 1
+                stats.consecutive_failures += 1
+                stats.recent_errors.append(str(error))
+                if stats.consecutive_failures >= self.quarantine_after:
+                    logger.info("Quarantine proxy {} for {}s".format(proxy, self.cooldown))
+                    stats.quarantined_until = time.time() + self.cooldown
+                    stats.consecutive_failures = 0
+
+    def stats(self):
+        """
+        Return the health data of every proxy
+        """
+        with self._lock:
+            return {proxy: stats.to_dict() for proxy, stats in self._proxies.items()}
+
+    def save(self, save_file=None):
+        """
+        Save the scores so they can be used in the next run
+        """
+        save_file = save_file or self.save_file
+        if save_file is None:
+            logger.error("save_file cannot be None")
+            return None
+
+        data = list(self.stats().values())
+        with open(save_file, 'w') as out_file:
+            json.dump(data, out_file)
+
+        return save_file
+
+    def load(self, save_file):
+        try:
+            with open(save_file, 'r') as in_file:
+                data = json.load(in_file)
+        except Exception:
+            logger.exception("Could not load proxy scores from {}".format(save_file))
+            return
+
+        with self._lock:
+            for item in data:
+                stats = ProxyStats.from_dict(item, max_samples=self.max_samples)
+                self._proxies[stats.proxy] = stats
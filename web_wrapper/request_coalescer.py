@@ -0,0 +1,130 @@
+import copy
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class _InFlight:
+    """
+    A fetch that other threads can wait on
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class RequestCoalescer:
+    """
+    Single flight layer for get_site
+    Concurrent requests with the same key wait on a single fetch and share its result.
+    If `cache_size` is more then 0, successful results are also kept for `cache_ttl` seconds
+    so requests right after it do not hit the network either.
+
+    Share a single instance between drivers (and threads) to dedup across them
+    """
+
+    def __init__(self, cache_size=0, cache_ttl=5):
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._cache = OrderedDict()
+        self._stats = {'requests': 0,
+                       'fetches': 0,
+                       'dedup_hits': 0,
+                       'cache_hits': 0,
+                       }
+
+    @staticmethod
+    def make_key(*parts):
+        """
+        Build a hashable key from the parts of a request, dicts are sorted so order does not matter
+        """
+        return json.dumps(parts, sort_keys=True, default=str)
+
+    def _cache_get(self, key):
+        item = self._cache.get(key)
+        if item is None:
+            return None
+
+        expires, value = item
+        if expires < time.time():
+            del self._cache[key]
+            return None
+
+        self._cache.move_to_end(key)
+        return value
+
+    def _cache_set(self, key, value):
+        if self.cache_size <= 0:
+            return
+
+        self._cache[key] = (time.time() + self.cache_ttl, value)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def fetch(self, key, fetch_func):
+        """
+        Return the result of `fetch_func()`, only calling it if there is no cached
+        result and no other thread is already fetching the same key
+        Exceptions raised by the fetch are raised in every waiting thread
+        """
+        with self._lock:
+            self._stats['requests'] += 1
+
+            value = self._cache_get(key)
+            if value is not None:
+                self._stats['cache_hits'] += 1
+                return value
+
+            call = self._in_flight.get(key)
+            is_leader = call is None
+            if is_leader is True:
+                call = self._in_flight[key] = _InFlight()
+                self._stats['fetches'] += 1
+            else:
+                self._stats['dedup_hits'] += 1
+
+        if is_leader is False:
+            call.event.wait()
+            if call.error is not None:
+                # Each thread gets its own exception, so tracebacks & attributes are not shared
+                raise copy.copy(call.error)
+            return call.result
+
+        try:
+            call.result = fetch_func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+                if call.error is None:
+                    self._cache_set(key, call.result)
+            call.event.set()
+
+        return call.result
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        """
+        Return the request counters
+        `dedup_hits` were served by a fetch already in flight, `cache_hits` by the cache
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['cache_size'] = len(self._cache)
+            stats['in_flight'] = len(self._in_flight)
+            return stats
@@ -0,0 +1,36 @@
+from bs4 import BeautifulSoup
+
+
+def free_soup(page):
+    """
+    Break up a BeautifulSoup tree so its memory is freed right away
+    The tree is full of parent/child reference cycles, so without this it stays around
+    until the garbage collector gets to it. Anything else is left alone.
+    """
+    if isinstance(page, BeautifulSoup):
+        page.decompose()
+
+
+class SiteResult:
+    """
+    Returned by get_site(..., return_result=True)
+    `body` is what get_site would have returned (the parsed page, or a Future with a parse_pool),
+    call `release()` once done with it
+    """
+    __slots__ = ('url', 'status_code', 'timings', 'transfer', 'coalesced', 'body')
+
+    def __init__(self, url, status_code, timings, transfer, coalesced, body):
+        self.url = url
+        self.status_code = status_code
+        self.timings = timings
+        self.transfer = transfer
+        self.coalesced = coalesced
+        self.body = body
+
+    def release(self):
+        free_soup(self.body)
+        self.body = None
+
+    def __repr__(self):
+        return 'SiteResult(url={!r}, status_code={}, body={})'.format(
+            self.url, self.status_code, type(self.body).__name__)
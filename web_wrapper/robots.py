@@ -0,0 +1,253 @@
+import re
+import time
+import logging
+import threading
+import urllib.parse
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class RobotsDisallowedError(IOError):
+    """
+    Raised by get_site when robots.txt does not allow the url, no request is made
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args)
+        self.url = kwargs.get('url')
+
+
+class RobotsRules:
+    """
+    Allow/Disallow rules from a robots.txt for a single user agent
+
+    Plain path prefixes are stored in a trie so a lookup is a single walk over the path,
+    rules with `*` or `$` are compiled to regexes. The longest matching rule wins, and
+    allow wins a tie (same as Google's robots.txt spec)
+    """
+
+    def __init__(self, rules=[], crawl_delay=None):
+        self.crawl_delay = crawl_delay
+        self._trie = {}
+        self._patterns = []
+
+        for allow, path in rules:
+            if not path:
+                # An empty Disallow means everything is allowed
+                continue
+            if '*' in path or path.endswith('$'):
+                regex = re.escape(path).replace('\\*', '.*')
+                if regex.endswith('\\$'):
+                    regex = regex[:-2] + '$'
+                self._patterns.append((re.compile(regex), allow, len(path)))
+            else:
+                node = self._trie
+                for char in path:
+                    node = node.setdefault(char, {})
+                # Keep allow if both are set for the same path
+                node[None] = node.get(None, False) or allow
+
+    @classmethod
+    def allow_all(cls):
+        return cls()
+
+    @classmethod
+    def disallow_all(cls):
+        return cls(rules=[(False, '/')])
+
+    def can_fetch(self, path):
+        best_length = -1
+        best_allow = True
+
+        node = self._trie
+        for length, char in enumerate(path, start=1):
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                best_length = length
+                best_allow = node[None]
+
+        for regex, allow, length in self._patterns:
+            if length < best_length or (length == best_length and best_allow is True):
+                continue
+            if regex.match(path):
+                best_length = length
+                best_allow = allow
+
+        return best_allow
+
+
+def parse_robots(text, user_agent='*'):
+    """
+    Return the RobotsRules that apply to `user_agent`
+    The group with the longest user-agent that is part of ours is used, falling back to `*`
+    """
+    groups = []
+    current = None
+    last_was_agent = False
+    for line in text.splitlines():
+        line = line.split('#', 1)[0].strip()
+        if ':' not in line:
+            continue
+        key, value = line.split(':', 1)
+        key = key.strip().lower()
+        value = value.strip()
+
+        if key == 'user-agent':
+            if last_was_agent is False:
+                current = {'agents': [], 'rules': [], 'crawl_delay': None}
+                groups.append(current)
+            current['agents'].append(value.lower())
+            last_was_agent = True
+            continue
+
+        last_was_agent = False
+        if current is None:
+            continue
+        if key in ('allow', 'disallow'):
+            current['rules'].append((key == 'allow', value))
+        elif key == 'crawl-delay':
+            try:
+                current['crawl_delay'] = float(value)
+            except ValueError:
+                pass
+
+    user_agent = user_agent.lower()
+    best_group = None
+    best_length = -1
+    for group in groups:
+        for agent in group['agents']:
+            if agent == '*':
+                length = 0
+            elif agent in user_agent:
+                length = len(agent)
+            else:
+                continue
+            if length > best_length:
+                best_group = group
+                best_length = length
+
+    if best_group is None:
+        return RobotsRules.allow_all()
+    return RobotsRules(best_group['rules'], crawl_delay=best_group['crawl_delay'])
+
+
+class RobotsCache:
+    """
+    Cache of parsed robots.txt rules per host, with a TTL and a max number of hosts (LRU)
+    Also paces requests to hosts that set a `Crawl-delay`
+
+    Pass into a driver as `robots=`. Share one instance between drivers so robots.txt is only
+    fetched once per host and the crawl delay is kept across all of them.
+    """
+
+    def __init__(self, user_agent='*', ttl=24 * 60 * 60, error_ttl=60, max_hosts=10000, max_crawl_delay=30):
+        self.user_agent = user_agent
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self.max_hosts = max_hosts
+        self.max_crawl_delay = max_crawl_delay
+
+        self._lock = threading.Lock()
+        # host -> (expires, RobotsRules)
+        self._rules = OrderedDict()
+        # host -> time the next request is allowed
+        self._next_request = {}
+        # host -> Event set once the robots.txt being fetched for it is cached
+        self._fetching = {}
+
+    @staticmethod
+    def robots_url(url):
+        parts = urllib.parse.urlsplit(url)
+        return urllib.parse.urlunsplit((parts.scheme, parts.netloc, '/robots.txt', '', ''))
+
+    def get_rules(self, url, fetch):
+        """
+        Return the rules for the host of `url`, calling `fetch(robots_url)` if they are not cached
+        `fetch` returns (status_code, text), status_code is None if the request failed
+        Only one thread fetches robots.txt for a host, the others wait for its result
+        """
+        host = urllib.parse.urlsplit(url).netloc
+        while True:
+            with self._lock:
+                item = self._rules.get(host)
+                if item is not None and item[0] > time.time():
+                    self._rules.move_to_end(host)
+                    return item[1]
+
+                fetching = self._fetching.get(host)
+                if fetching is None:
+                    fetching = self._fetching[host] = threading.Event()
+                    break
+
+            # If that fetch fails the rules are still not cached and this thread tries
+            fetching.wait()
+
+        try:
+            return self._fetch_rules(host, url, fetch)
+        finally:
+            with self._lock:
+                del self._fetching[host]
+            fetching.set()
+
+    def _fetch_rules(self, host, url, fetch):
+        status_code, text = fetch(self.robots_url(url))
+        ttl = self.ttl
+        if status_code is not None and status_code < 400:
+            rules = parse_robots(text or '', user_agent=self.user_agent)
+        elif status_code is not None and status_code < 500:
+            # No robots.txt, everything is allowed
+            rules = RobotsRules.allow_all()
+        else:
+            # Server errors mean we can not know, so nothing is allowed until it is tried again
+            logger.warning("Could not get robots.txt for {}, disallowing for {}s".format(host, self.error_ttl))
+            rules = RobotsRules.disallow_all()
+            ttl = self.error_ttl
+
+        with self._lock:
+            self._rules[host] = (time.time() + ttl, rules)
+            self._rules.move_to_end(host)
+            while len(self._rules) > self.max_hosts:
+                old_host, _ = self._rules.popitem(last=False)
+                self._next_request.pop(old_host, None)
+
+        return rules
+
+    def check(self, url, fetch):
+        """
+        Return (allowed, crawl_delay) for the url
+        """
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        rules = self.get_rules(url, fetch)
+        return rules.can_fetch(path), rules.crawl_delay
+
+    def can_fetch(self, url, fetch):
+        return self.check(url, fetch)[0]
+
+    def wait(self, url, crawl_delay):
+        """
+        Sleep until the host can be requested again, based on its crawl delay
+        """
+        if not crawl_delay:
+            return
+
+        crawl_delay = min(crawl_delay, self.max_crawl_delay)
+        host = urllib.parse.urlsplit(url).netloc
+        with self._lock:
+            now = time.time()
+            request_time = max(now, self._next_request.get(host, 0))
+            # Reserve the slot now so other threads queue up behind this one
+            self._next_request[host] = request_time + crawl_delay
+
+        if request_time > now:
+            time.sleep(request_time - now)
+
+    def clear(self):
+        with self._lock:
+            self._rules.clear()
+            self._next_request.clear()
@@ -3,9 +3,11 @@ import sys
 import time
 import json
 import logging
+import urllib.parse
 from PIL import Image
 from selenium import webdriver
 from selenium.common.exceptions import TimeoutException, WebDriverException
+from web_wrapper.session_state import normalize_cookies
 
 
 logger = logging.getLogger(__name__)
@@ -26,6 +28,159 @@ class SeleniumHTTPError(IOError):
 
 class SeleniumUtils:
 
+    # Cookies Set/Get
+    def get_cookies(self):
+        return self.driver.get_cookies()
+
+    def set_cookies(self, cookies):
+        try:
+            # delete_all_cookies only clears the current page's domain
+            self.driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+        except Exception:
+            logger.debug("Could not clear all cookies, only clearing the current page's", exc_info=True)
+            self.driver.delete_all_cookies()
+        self._pending_cookies = []
+        self._import_cookies(cookies)
+
+    def update_cookies(self, cookies):
+        self._import_cookies(cookies)
+
+    def get_proxy(self):
+        return self.current_proxy
+
+    def _reset_pending_state(self):
+        # Cookies and local storage that can only be set once a page is loaded
+        self._pending_cookies = []
+        self._pending_local_storage = {}
+
+    # Session state
+    def _export_cookies(self):
+        """
+        Get the cookies for every domain, selenium on its own only has the current page's
+        """
+        try:
+            return normalize_cookies(self.driver.execute_cdp_cmd('Network.getAllCookies', {})['cookies'])
+        except Exception:
+            logger.debug("Could not get all cookies, only using the current page's", exc_info=True)
+            return normalize_cookies(self.driver.get_cookies())
+
+    def _import_cookies(self, cookies):
+        """
+        Set cookies for any domain without having to load a page on that domain first
+        Cookies without a domain, or that could not be set that way, are set when the next page
+        is loaded, see _set_pending_cookies
+        """
+        for cookie in normalize_cookies(cookies):
+            if cookie.get('domain') is None or self._set_browser_cookie(cookie) is False:
+                self._pending_cookies.append(cookie)
+
+    def _set_browser_cookie(self, cookie, url=None):
+        """
+        Set a cookie for any domain using CDP, `url` is used for cookies without a domain
+        Returns False if the cookie could not be set
+        """
+        cdp_cookie = {'name': cookie['name'],
+                      'value': cookie['value'],
+                      'path': cookie.get('path', '/'),
+                      'secure': cookie.get('secure', False),
+                      'httpOnly': cookie.get('httpOnly', False),
+                      }
+        if cookie.get('domain') is not None:
+            cdp_cookie['domain'] = cookie['domain']
+        if url is not None:
+            cdp_cookie['url'] = url
+        if cookie.get('expiry') is not None:
+            cdp_cookie['expires'] = cookie['expiry']
+        try:
+            return self.driver.execute_cdp_cmd('Network.setCookie', cdp_cookie).get('success', True) is not False
+        except Exception:
+            return False
+
+    def _set_pending_cookies(self, url, loaded=False):
+        """
+        Before `url` is loaded the pending cookies for its host are set using CDP, once it has
+        loaded any that are left are set with selenium's add_cookie (only works for the current page)
+        Cookies for other domains stay pending
+        """
+        host = urllib.parse.urlsplit(url).hostname or ''
+        pending = []
+        for cookie in self._pending_cookies:
+            domain = cookie.get('domain')
+            if domain is not None and not ('.' + host).endswith('.' + domain.lstrip('.')):
+                pending.append(cookie)
+            elif loaded is False:
+                if self._set_browser_cookie(cookie, url=url) is False:
+                    pending.append(cookie)
+            else:
+                try:
+                    self.driver.add_cookie(cookie)
+                except Exception:
+                    logger.warning("Could not set cookie {} for {}".format(cookie['name'], domain or host))
+        self._pending_cookies = pending
+
+    def _export_headers(self):
+        headers = dict(self.current_headers)
+        if 'User-Agent' not in headers:
+            # Keep the browsers user agent so the session looks the same when used elsewhere
+            try:
+                headers['User-Agent'] = self.driver.execute_script("return navigator.userAgent")
+            except Exception:
+                logger.debug("Could not get the user agent", exc_info=True)
+        return headers
+
+    def _export_local_storage(self):
+        """
+        Local storage of the current page, keyed by its origin
+        """
+        try:
+            origin = self.driver.execute_script("return window.location.origin")
+            items = self.driver.execute_script("return Object.assign({}, window.localStorage)")
+        except Exception:
+            logger.debug("Could not get local storage", exc_info=True)
+            return {}
+
+        if not origin or origin == 'null' or not items:
+            return {}
+        return {origin: items}
+
+    def _import_local_storage(self, local_storage):
+        """
+        Local storage can only be set from a page on the same origin, so it is set once that origin
+        is loaded. Chrome sets it before the page's own scripts run
+        """
+        for origin, items in local_storage.items():
+            script = ("if (window.location.origin === {}) {{"
+                      "  var items = {};"
+                      "  for (var key in items) {{ window.localStorage.setItem(key, items[key]); }}"
+                      "}}").format(json.dumps(origin), json.dumps(items))
+            try:
+                identifier = self.driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument',
+                                                         {'source': script})['identifier']
+            except Exception:
+                identifier = None
+            self._pending_local_storage[origin] = (identifier, items)
+
+    def _set_pending_local_storage(self):
+        try:
+            origin = self.driver.execute_script("return window.location.origin")
+        except Exception:
+            logger.debug("Could not get the origin of the page", exc_info=True)
+            return
+
+        identifier, items = self._pending_local_storage.pop(origin, (None, None))
+        if items is None:
+            return
+        try:
+            if identifier is not None:
+                # Already set by the script before the page loaded, later page loads do not need it
+                self.driver.execute_cdp_cmd('Page.removeScriptToEvaluateOnNewDocument', {'identifier': identifier})
+            else:
+                self.driver.execute_script("for (var key in arguments[0]) {"
+                                           "  window.localStorage.setItem(key, arguments[0][key]);"
+                                           "}", items)
+        except Exception:
+            logger.warning("Could not set local storage for {}".format(origin), exc_info=True)
+
     def get_selenium_header(self):
         """
         Return server response headers from selenium request
@@ -60,6 +215,27 @@ class SeleniumUtils:
 
         return self.driver.execute_script(javascript)
 
+    def get_navigation_timing(self):
+        """
+        Return the browsers navigation timing data of the current page in seconds
+        """
+        javascript = """
+                     var t = window.performance.timing;
+                     return {'dns': t.domainLookupEnd - t.domainLookupStart,
+                             'connect': t.connectEnd - t.connectStart,
+                             'tls': t.secureConnectionStart > 0 ? t.connectEnd - t.secureConnectionStart : 0,
+                             'ttfb': t.responseStart - t.requestStart,
+                             'download': t.responseEnd - t.responseStart,
+                             'dom': t.domComplete - t.responseEnd};
+                     """
+        try:
+            timing = self.driver.execute_script(javascript)
+        except Exception:
+            logger.debug("Could not get navigation timing", exc_info=True)
+            return {}
+
+        return {key: max(0, value) / 1000 for key, value in timing.items()}
+
     def _get_site(self, url, headers, cookies, timeout, driver_args, driver_kwargs):
         """
         Try and return page content in the requested format using selenium
@@ -70,7 +246,13 @@ class SeleniumUtils:
             # Then still try and get the source from the page
             self.driver.set_page_load_timeout(timeout)
 
+            if self._pending_cookies:
+                self._set_pending_cookies(url)
             self.driver.get(url)
+            if self._pending_cookies:
+                self._set_pending_cookies(self.driver.current_url, loaded=True)
+            if self._pending_local_storage:
+                self._set_pending_local_storage()
             header_data = self.get_selenium_header()
             status_code = header_data['status-code']
 
@@ -78,6 +260,10 @@ class SeleniumUtils:
             self.status_code = status_code
             self.url = self.driver.current_url
 
+            if self.has_hooks():
+                # Costs another round trip to the browser, so only get it if someone is listening
+                self.timings.update(self.get_navigation_timing())
+
         except TimeoutException:
             logger.warning("Page timeout: {}".format(url))
             try:
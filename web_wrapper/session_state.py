@@ -0,0 +1,105 @@
+import gzip
+import json
+import logging
+from requests.cookies import create_cookie
+
+logger = logging.getLogger(__name__)
+
+STATE_VERSION = 1
+
+# Keys kept for each cookie, same names selenium uses
+COOKIE_KEYS = ('name', 'value', 'domain', 'path', 'expiry', 'secure', 'httpOnly')
+
+
+def normalize_cookies(cookies):
+    """
+    Return cookies as a list of dicts in the selenium format
+    Accepts a dict of {name: value}, a single cookie dict or a list of either
+    """
+    if not cookies:
+        return []
+
+    if isinstance(cookies, dict):
+        if 'name' in cookies and 'value' in cookies:
+            cookies = [cookies]
+        else:
+            cookies = [{'name': name, 'value': value} for name, value in cookies.items()]
+
+    clean_cookies = []
+    for cookie in cookies:
+        if 'name' in cookie and 'value' in cookie:
+            clean_cookie = {key: cookie[key] for key in COOKIE_KEYS if cookie.get(key) is not None}
+            if clean_cookie.get('domain') == '':
+                # No domain means the cookie is sent everywhere, leave it out so drivers use their default
+                del clean_cookie['domain']
+            if 'expiry' not in clean_cookie and cookie.get('expirationDate') is not None:
+                # Format used by browser extensions
+                clean_cookie['expiry'] = int(cookie['expirationDate'])
+            clean_cookies.append(clean_cookie)
+        else:
+            for name, value in cookie.items():
+                clean_cookies.append({'name': name, 'value': value})
+
+    return clean_cookies
+
+
+def merge_cookies(cookies, new_cookies):
+    """
+    Add `new_cookies` to `cookies`, replacing ones with the same name, domain and path
+    """
+    merged = {}
+    for cookie in normalize_cookies(cookies) + normalize_cookies(new_cookies):
+        merged[(cookie['name'], cookie.get('domain'), cookie.get('path'))] = cookie
+    return list(merged.values())
+
+
+def cookies_from_jar(jar):
+    """
+    Cookies in a http.cookiejar.CookieJar (used by requests & httpx) as selenium style dicts
+    """
+    cookies = []
+    for cookie in jar:
+        cookies.append({'name': cookie.name,
+                        'value': cookie.value,
+                        'domain': cookie.domain,
+                        'path': cookie.path,
+                        'expiry': cookie.expires,
+                        'secure': cookie.secure,
+                        'httpOnly': cookie.has_nonstandard_attr('HttpOnly'),
+                        })
+    return normalize_cookies(cookies)
+
+
+def add_cookies_to_jar(jar, cookies):
+    """
+    Add cookies in any format normalize_cookies takes to a http.cookiejar.CookieJar
+    """
+    for cookie in normalize_cookies(cookies):
+        jar.set_cookie(create_cookie(cookie['name'],
+                                     cookie['value'],
+                                     domain=cookie.get('domain', ''),
+                                     path=cookie.get('path', '/'),
+                                     expires=cookie.get('expiry'),
+                                     secure=cookie.get('secure', False),
+                                     rest={'HttpOnly': True} if cookie.get('httpOnly') else {},
+                                     ))
+
+
+def save_state(state, save_path):
+    """
+    Write the session state to a gzipped json file
+    """
+    state = dict(state, version=STATE_VERSION)
+    with gzip.open(save_path, 'wt', encoding='utf-8') as out_file:
+        json.dump(state, out_file, separators=(',', ':'))
+    return save_path
+
+
+def load_state(save_path):
+    with gzip.open(save_path, 'rt', encoding='utf-8') as in_file:
+        state = json.load(in_file)
+
+    if state.get('version') != STATE_VERSION:
+        logger.warning("Session state {} is version {}, expected {}"
+                       .format(save_path, state.get('version'), STATE_VERSION))
+    return state
@@ -1,10 +1,13 @@
 import os
 import re
+import copy
 import sys
 import json
 import time
 import cutil
 import urllib
+import urllib.error
+import urllib.request
 import logging
 import requests
 from PIL import Image  # pip install pillow
@@ -12,9 +15,19 @@ from io import BytesIO
 from parsel import Selector
 from bs4 import BeautifulSoup
 from web_wrapper.selenium_utils import SeleniumHTTPError
+from web_wrapper.circuit_breaker import CircuitOpenError
+from web_wrapper.profiler import Profiler, profile_from_env
+from web_wrapper.archive import ArchiveMissError
+from web_wrapper.pipeline import Pipeline
+from web_wrapper.result import SiteResult, free_soup
+from web_wrapper.robots import RobotsDisallowedError
+from web_wrapper import session_state
 
 logger = logging.getLogger(__name__)
 
+# Events that functions can be attached to using Web.add_hook()
+HOOK_NAMES = ('on_request', 'on_response', 'on_retry', 'on_parse', 'on_new_profile')
+
 """
 Things to add:
     - (selenium) Scroll to load page
@@ -29,16 +42,49 @@ class Web:
     Need to be on its own that way each profile can have its own instance of it for proxy support
     """
 
-    def __init__(self, headers={}, cookies={}, proxy=None, **driver_args):
+    def __init__(self, headers={}, cookies={}, proxy=None, proxy_pool=None, circuit_breaker=None,
+                 request_coalescer=None, archive=None, parse_pool=None,
+                 robots=None, retain_response=True, decompose_soup=False, **driver_args):
         self.scraper = None
 
         self.driver = None
         self.driver_args = driver_args
+
+        # Optional ProxyPool used by new_proxy()
+        self.proxy_pool = proxy_pool
+        if proxy is None and self.proxy_pool is not None:
+            proxy = self.proxy_pool.get_proxy()
         self.current_proxy = proxy
 
+        # Optional CircuitBreaker, share one between drivers to share the host states
+        self.circuit_breaker = circuit_breaker
+        # Count of results sent to the circuit breaker, so get_site can tell if a request never sent one
+        self._host_results = 0
+
+        # Optional RequestCoalescer, dedups concurrent requests for the same page
+        self.request_coalescer = request_coalescer
+
+        # Optional RequestArchive, to record every response or replay them from disk
+        self.archive = archive
+
+        # Optional ParsePool, to parse pages in other processes
+        self.parse_pool = parse_pool
+
+        # Optional RobotsCache, to follow robots.txt rules and crawl delays
+        self.robots = robots
+
+        # With False, `self.response` (the body and all) is dropped once get_site is done with it
+        self.retain_response = retain_response
+
+        # With True, soups are decomposed once a parse_callback or pipeline stages are done with them
+        self.decompose_soup = decompose_soup
+
         # Number of times to re-try a url
         self._num_retries = 3
 
+        # Functions to call on each request event
+        self.hooks = {hook_name: [] for hook_name in HOOK_NAMES}
+
         if headers is not None:
             self.current_headers = headers
         else:
@@ -52,6 +98,9 @@ class Web:
         # Set the default response values
         self._reset_response()
 
+        # Profile every get_site call if the WEB_WRAPPER_PROFILE env var is set
+        self.profiler = profile_from_env(self)
+
     def _reset_response(self):
         """
         Vars to track per request made
@@ -60,6 +109,68 @@ class Web:
         self.status_code = None
         self.url = None
         self.response = None
+        # Seconds spent in each stage of the request
+        self.timings = {}
+        # Bytes over the wire vs decoded and how the charset was found, if the driver knows
+        self.transfer = {}
+        # True if the response came from the request coalescer and not from our own request
+        self.coalesced = False
+
+    def profile(self, output_dir='.', interval=0.005, trace_memory=True):
+        """
+        Context manager to profile the get_site calls made inside of it
+        """
+        return Profiler(self, output_dir=output_dir, interval=interval, trace_memory=trace_memory)
+
+    def stream(self, inputs, workers=1, web_factory=None, max_in_flight=None, ordered=False, stages=[],
+               **get_site_kwargs):
+        """
+        Lazily run get_site on every url (or dict of get_site kwargs) in `inputs`
+        Yields a PipelineResult for each, see Pipeline for the options
+        The driver state is not thread safe, so with more then 1 worker a `web_factory`
+        is needed to create a driver for each worker
+        """
+        if web_factory is None:
+            if workers > 1:
+                raise ValueError("web_factory is needed when using more then 1 worker")
+            pipeline = Pipeline(lambda: self, workers=1, max_in_flight=max_in_flight, ordered=ordered,
+                                stages=stages, get_site_kwargs=get_site_kwargs, quit_drivers=False)
+        else:
+            pipeline = Pipeline(web_factory, workers=workers, max_in_flight=max_in_flight, ordered=ordered,
+                                stages=stages, get_site_kwargs=get_site_kwargs)
+
+        return pipeline.run(inputs)
+
+    ###########################################################################
+    # Hooks
+    ###########################################################################
+    def add_hook(self, hook_name, func):
+        """
+        Call `func(web, event)` on every `hook_name` event
+        `event` is a dict with the url and data for that event (like timings)
+        """
+        if hook_name not in self.hooks:
+            raise ValueError("Unknown hook {}, must be one of {}".format(hook_name, HOOK_NAMES))
+        self.hooks[hook_name].append(func)
+
+    def remove_hook(self, hook_name, func):
+        if func in self.hooks.get(hook_name, []):
+            self.hooks[hook_name].remove(func)
+
+    def has_hooks(self):
+        return any(self.hooks.values())
+
+    def _fire_hook(self, hook_name, **event):
+        funcs = self.hooks[hook_name]
+        if not funcs:
+            # Nothing is listening, skip building anything
+            return
+
+        for func in funcs:
+            try:
+                func(self, event)
+            except Exception:
+                logger.exception("Hook {} failed".format(hook_name))
 
     def get_image_dimension(self, url):
         """
@@ -71,7 +182,14 @@ class Web:
         try:
             if url.startswith('//'):
                 url = 'http:' + url
-            data = requests.get(url).content
+            if self.archive is not None and self.archive.is_replaying:
+                data = self._replay_response(url).content
+            else:
+                response = requests.get(url)
+                data = response.content
+                if self.archive is not None:
+                    self.archive.record(url, response.status_code, data, headers=response.headers,
+                                        final_url=response.url, elapsed=response.elapsed.total_seconds())
             im = Image.open(BytesIO(data))
 
             w_h = im.size
@@ -158,8 +276,79 @@ class Web:
 
         return save_location
 
+    ###########################################################################
+    # Session state
+    ###########################################################################
+    def get_state(self):
+        """
+        Return the cookies, headers, proxy and local storage of the session
+        The format is the same for every driver so it can be loaded into any of them
+        """
+        return {'driver_type': self.driver_type,
+                'url': self.url,
+                'headers': self._export_headers(),
+                'cookies': self._export_cookies(),
+                'proxy': self.get_proxy(),
+                'local_storage': self._export_local_storage(),
+                }
+
+    def set_state(self, state, use_proxy=True):
+        """
+        Load a state from get_state() into this driver
+        """
+        if state.get('headers'):
+            self.update_headers(state['headers'])
+        if use_proxy is True and state.get('proxy') != self.get_proxy():
+            self.set_proxy(state.get('proxy'))
+        self.set_cookies(state.get('cookies', []))
+        self._import_local_storage(state.get('local_storage', {}))
+
+    def save_state(self, save_path):
+        """
+        Save the session to a file so a new worker can start with it
+        """
+        save_location = cutil.norm_path(save_path)
+        cutil.create_path(save_location)
+        return session_state.save_state(self.get_state(), save_location)
+
+    def load_state(self, save_path, use_proxy=True):
+        state = session_state.load_state(cutil.norm_path(save_path))
+        self.set_state(state, use_proxy=use_proxy)
+        return state
+
     def new_proxy(self):
-        raise NotImplementedError
+        if self.proxy_pool is None:
+            raise NotImplementedError
+        return self.proxy_pool.get_proxy()
+
+    def _report_proxy(self, latency=None, error=None):
+        """
+        Let the proxy pool know how the request with the current proxy went
+        Coalesced and replayed responses never went through the proxy, so are not reported
+        """
+        if self.proxy_pool is None or self.coalesced is True:
+            return
+        if self.archive is not None and self.archive.is_replaying:
+            return
+        try:
+            self.proxy_pool.report(self.current_proxy, latency=latency, error=error)
+        except Exception:
+            logger.exception("Something went wrong when reporting to the proxy pool")
+
+    def _record_host_result(self, url, success):
+        """
+        Let the circuit breaker know if the host is up or not
+        """
+        if self.circuit_breaker is None:
+            return
+        if success is False and self.coalesced is True:
+            # The leader of the coalesced request already recorded this failure
+            return
+        self._host_results += 1
+        if success is True:
+            self.circuit_breaker.record_success(url)
+        else:
+            self.circuit_breaker.record_failure(url)
 
     def new_headers(self):
         raise NotImplementedError
@@ -182,8 +371,19 @@ class Web:
         except Exception:
             logger.exception("Something went wrong when getting a new header")
 
+    def _retry_backoff(self, sleep):
+        """
+        Wait and switch to a new profile before trying again
+        Replayed responses are the same no matter the wait or profile, so both are skipped
+        """
+        if self.archive is not None and self.archive.is_replaying:
+            return
+        time.sleep(sleep)
+        self.new_profile()
+
     def new_profile(self):
         logger.info("Create a new profile to use")
+        self._fire_hook('on_new_profile')
         self._try_new_proxy()
         self._try_new_headers()
 
@@ -193,9 +393,12 @@ class Web:
     def get_site(self, url, cookies={}, page_format='html', return_on_error=[], retry_enabled=True,
                  num_tries=0, num_apikey_tries=0, headers={}, api=False, track_stat=True, timeout=30,
                  force_requests=False, driver_args=(), driver_kwargs={}, parser='beautifulsoup',
-                 custom_source_checks=[]):
+                 custom_source_checks=[], parse_callback=None, return_result=False):
         """
         headers & cookies - Will update to the current headers/cookies and just be for this request
+        parse_callback - Called with the parsed page, its return value is returned instead
+            If the driver has a parse_pool, parsing & the callback run in the pool and a Future is returned
+        return_result - Return a SiteResult with the status, url & timings, the page is its `body`
         driver_args & driver_kwargs - Gets passed and expanded out to the driver
         """
         self._reset_response()
@@ -235,72 +438,319 @@ class Web:
         url = prepend + url
 
         ##
-        # Try and get the page
+        # Fail fast if the host has been failing
         ##
-        rdata = None
+        if self.circuit_breaker is not None and self.circuit_breaker.allow_request(url) is False:
+            logger.warning("Circuit open [get_site]: skipping {}".format(url))
+            raise CircuitOpenError("Circuit open for host", host=self.circuit_breaker.get_host(url))
+
+        host_results = self._host_results
         try:
-            source_text = self._get_site(url, headers, cookies, timeout, driver_args, driver_kwargs)
-            if custom_source_checks:
-                # Check if there are any custom check to run
-                for re_text, status_code in custom_source_checks:
-                    if re.search(re_text, source_text):
-                        if self.response is None:
-                            # This is needed when using selenium and we still need to pass in the 'response'
-                            self.response = type('', (), {})()
-                        self.response.status_code = status_code
-                        self.status_code = status_code
-                        raise requests.exceptions.HTTPError("Custom matched status code", response=self.response)
-
-            rdata = self.parse_source(source_text, page_format, parser)
+            ##
+            # Follow robots.txt
+            ##
+            if self.robots is not None:
+                allowed, crawl_delay = self.robots.check(url, self._fetch_robots)
+                if allowed is False:
+                    logger.info("Disallowed by robots.txt [get_site]: {}".format(url))
+                    raise RobotsDisallowedError("Disallowed by robots.txt", url=url)
+                self.robots.wait(url, crawl_delay)
+
+            ##
+            # Try and get the page
+            ##
+            rdata = None
+            request_time = None
+            try:
+                self._fire_hook('on_request', url=url, num_tries=num_tries)
+                request_start = time.perf_counter()
+                source_text = self._fetch_site(url, headers, cookies, timeout, driver_args, driver_kwargs,
+                                               custom_source_checks=custom_source_checks, num_tries=num_tries)
+                request_time = time.perf_counter() - request_start
+                self.timings['fetch'] = request_time
+                self._record_host_result(url, source_text is not None)
+                self._fire_hook('on_response', url=url, status_code=self.status_code, timings=self.timings,
+                                size=len(source_text or ''), coalesced=self.coalesced, transfer=self.transfer)
+
+                checks_start = time.perf_counter()
+                if custom_source_checks:
+                    # Check if there are any custom check to run
+                    self._run_source_checks(source_text, custom_source_checks)
+                self.timings['checks'] = time.perf_counter() - checks_start
+
+                self._report_proxy(latency=request_time)
+                parse_start = time.perf_counter()
+                if self.parse_pool is not None:
+                    # The pool reads the raw bytes from the response, so release it after
+                    rdata = self._submit_parse(source_text, page_format, parser, parse_callback)
+                    self._release_response()
+                    self._time_parse_future(rdata, url, page_format, parser, parse_start)
+                else:
+                    self._release_response()
+                    rdata = self.parse_source(source_text, page_format, parser)
+                    if parse_callback is not None:
+                        page = rdata
+                        rdata = parse_callback(page)
+                        if self.decompose_soup is True and rdata is not page:
+                            free_soup(page)
+                    self.timings['parse'] = time.perf_counter() - parse_start
+                    self._fire_hook('on_parse', url=url, page_format=page_format, parser=parser,
+                                    timings=self.timings)
+
+            ##
+            # Exceptions from Selenium
+            ##
+            # Nothing yet
+
+            ##
+            # Exceptions from Requests
+            ##
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                """
+                Try again with a new profile (do not get new apikey)
+                Wait n seconds before trying again
+                """
+                e_name = type(e).__name__
+                self._report_proxy(error=e_name)
+                self._record_host_result(url, False)
+                if num_tries < self._num_retries and retry_enabled is True:
+                    logger.info("{} [get_site]: try #{} on {} Error {}".format(e_name, num_tries, url, e))
+                    self._fire_hook('on_retry', url=url, num_tries=num_tries, reason=e_name, sleep=2)
+                    self._retry_backoff(2)
+                    return self.get_site(*get_site_args, **get_site_kwargs)
+
+                else:
+                    logger.error("{} [get_site]: try #{} on{}".format(e_name, num_tries, url))
+
+            except requests.exceptions.TooManyRedirects as e:
+                logger.exception("TooManyRedirects [get_site]: {}".format(url))
+                self._record_host_result(url, False)
+
+            ##
+            # Exceptions shared by Selenium and Requests
+            ##
+            except (requests.exceptions.HTTPError, SeleniumHTTPError) as e:
+                """
+                Check the status code returned to see what should be done
+                """
+                status_code = str(e.response.status_code)
+                if self.status_code is None:
+                    # Coalesced waiters only get the error from the leader
+                    self.status_code = int(status_code)
+                self._report_proxy(error=status_code)
+                if request_time is None:
+                    self.timings['fetch'] = time.perf_counter() - request_start
+                    # Server errors mean the host is having problems, anything else means it is up
+                    self._record_host_result(url, int(status_code) < 500)
+                    self._fire_hook('on_response', url=url, status_code=self.status_code or int(status_code),
+                                    timings=self.timings, size=self.transfer.get('decoded_bytes', 0),
+                                    coalesced=self.coalesced, transfer=self.transfer)
+                self._release_response()
+                # If the client wants to handle the error send it to them
+                if int(status_code) in return_on_error:
+                    raise e.with_traceback(sys.exc_info()[2])
+
+                try_again = self._get_site_status_code(url, status_code, api, num_tries, num_apikey_tries)
+                if try_again is True and retry_enabled is True:
+                    # If True then try request again
+                    return self.get_site(*get_site_args, **get_site_kwargs)
+
+            except ArchiveMissError:
+                # Strict replay, let the caller know the url was never recorded
+                raise
+
+            # Every other exceptions that were not caught
+            except Exception:
+                logger.exception("Unknown Exception [get_site]: {url}".format(url=url))
+                if request_time is None:
+                    # The request itself failed
+                    self._record_host_result(url, False)
+
+            if return_result is True:
+                return SiteResult(self.url or url, self.status_code, self.timings, self.transfer, self.coalesced, rdata)
+            return rdata
+        finally:
+            if self.circuit_breaker is not None and self._host_results == host_results:
+                # Nothing was recorded for this request, free up the half open probe it may hold
+                self.circuit_breaker.release(url)
+
+    def _release_response(self):
+        if self.retain_response is False:
+            self.response = None
+
+    def _fetch_robots(self, robots_url):
+        """
+        Get robots.txt using the driver, returns (status_code, text)
+        Recorded to and replayed from the archive like any other page
+        """
+        try:
+            if self.archive is not None and self.archive.is_replaying:
+                text = self._replay_site(robots_url)
+            else:
+                text = self._get_site_recorded(robots_url, {}, {}, 30, (), {})
+            status_code = self.status_code
+            if text is not None and self.driver_type.startswith('selenium'):
+                # Browsers wrap plain text in html
+                text = self.get_soup(text, input_type='html').get_text()
+        except (requests.exceptions.HTTPError, SeleniumHTTPError) as e:
+            status_code = int(e.response.status_code)
+            text = None
+        except ArchiveMissError:
+            # Recorded without robots.txt, act like the site has none
+            logger.info("{} is not in the archive, allowing everything".format(robots_url))
+            status_code = 404
+            text = None
+        except Exception:
+            logger.warning("Failed to get {}".format(robots_url), exc_info=True)
+            status_code = None
+            text = None
 
-        ##
-        # Exceptions from Selenium
-        ##
-        # Nothing yet
+        # Do not leave the robots.txt response as the current one
+        self._reset_response()
+        return status_code, text
 
-        ##
-        # Exceptions from Requests
-        ##
-        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
-            """
-            Try again with a new profile (do not get new apikey)
-            Wait n seconds before trying again
-            """
-            e_name = type(e).__name__
-            if num_tries < self._num_retries and retry_enabled is True:
-                logger.info("{} [get_site]: try #{} on {} Error {}".format(e_name, num_tries, url, e))
-                time.sleep(2)
-                self.new_profile()
-                return self.get_site(*get_site_args, **get_site_kwargs)
+    def _submit_parse(self, source_text, page_format, parser, parse_callback):
+        """
+        Send the raw body to the parse pool, returns a Future
+        """
+        raw = source_text
+        encoding = None
+        if isinstance(self.response, requests.Response):
+            # Skip re-encoding the text, the worker decodes the original bytes
+            raw = self.response.content
+            encoding = self.response.encoding
+        return self.parse_pool.submit(raw, page_format=page_format, parser=parser, callback=parse_callback,
+                                      encoding=encoding)
+
+    def _time_parse_future(self, future, url, page_format, parser, parse_start):
+        """
+        Set the parse time and fire on_parse once the pool is done with the page
+        """
+        # The next get_site starts a new timings dict, keep this request's
+        timings = self.timings
 
-            else:
-                logger.error("{} [get_site]: try #{} on{}".format(e_name, num_tries, url))
+        def parse_done(_):
+            timings['parse'] = time.perf_counter() - parse_start
+            self._fire_hook('on_parse', url=url, page_format=page_format, parser=parser, timings=timings)
 
-        except requests.exceptions.TooManyRedirects as e:
-            logger.exception("TooManyRedirects [get_site]: {}".format(url))
+        future.add_done_callback(parse_done)
 
-        ##
-        # Exceptions shared by Selenium and Requests
-        ##
-        except (requests.exceptions.HTTPError, SeleniumHTTPError) as e:
-            """
-            Check the status code returned to see what should be done
-            """
-            status_code = str(e.response.status_code)
-            # If the client wants to handle the error send it to them
-            if int(status_code) in return_on_error:
-                raise e.with_traceback(sys.exc_info()[2])
+    def _run_source_checks(self, source_text, custom_source_checks):
+        """
+        Raise an HTTPError with the matching status code if any of the regexes match the source
+        """
+        for re_text, status_code in custom_source_checks:
+            if re.search(re_text, source_text):
+                if self.response is None:
+                    # This is needed when using selenium and we still need to pass in the 'response'
+                    self.response = type('', (), {})()
+                else:
+                    # The response may be shared with other drivers by the request coalescer
+                    self.response = copy.copy(self.response)
+                self.response.status_code = status_code
+                self.status_code = status_code
+                raise requests.exceptions.HTTPError("Custom matched status code", response=self.response)
+
+    def _fetch_site(self, url, headers, cookies, timeout, driver_args, driver_kwargs, custom_source_checks=[],
+                    num_tries=1):
+        """
+        Call the drivers _get_site, going through the request coalescer if one is set
+        Retries skip the coalescer, they need a new request with the new profile
+        """
+        if self.archive is not None and self.archive.is_replaying:
+            return self._replay_site(url)
+
+        if self.request_coalescer is None or num_tries > 1:
+            return self._get_site_recorded(url, headers, cookies, timeout, driver_args, driver_kwargs)
 
-            try_again = self._get_site_status_code(url, status_code, api, num_tries, num_apikey_tries)
-            if try_again is True and retry_enabled is True:
-                # If True then try request again
-                return self.get_site(*get_site_args, **get_site_kwargs)
+        self.coalesced = True
 
-        # Every other exceptions that were not caught
+        def fetch():
+            self.coalesced = False
+            source_text = self._get_site_recorded(url, headers, cookies, timeout, driver_args, driver_kwargs)
+            if custom_source_checks:
+                # So a challenge page is never shared or cached
+                self._run_source_checks(source_text, custom_source_checks)
+            return (source_text, self.status_code, self.url, self.response)
+
+        key = self.request_coalescer.make_key(self.driver_type, url, headers, cookies)
+        source_text, self.status_code, self.url, response = self.request_coalescer.fetch(key, fetch)
+        if self.coalesced is True:
+            # Every driver gets its own copy of a shared response
+            response = copy.copy(response)
+        self.response = response
+        return source_text
+
+    def _get_site_recorded(self, url, headers, cookies, timeout, driver_args, driver_kwargs):
+        """
+        Call the drivers _get_site, saving the response to the archive when recording
+        """
+        if self.archive is None:
+            return self._get_site(url, headers, cookies, timeout, driver_args, driver_kwargs)
+
+        request_start = time.perf_counter()
+        source_text = None
+        try:
+            source_text = self._get_site(url, headers, cookies, timeout, driver_args, driver_kwargs)
+            return source_text
+        except (requests.exceptions.HTTPError, SeleniumHTTPError):
+            # Keep errors as well so they are the same when replayed
+            raise
         except Exception:
-            logger.exception("Unknown Exception [get_site]: {url}".format(url=url))
+            # Nothing to save if no response came back
+            request_start = None
+            raise
+        finally:
+            if request_start is not None:
+                self._archive_site(url, headers, source_text, time.perf_counter() - request_start)
+
+    def _archive_site(self, url, request_headers, source_text, elapsed):
+        response = self.response
+        if response is not None:
+            # requests or httpx response
+            self.archive.record(url, response.status_code, response.content,
+                                headers=response.headers,
+                                request_headers=request_headers,
+                                final_url=str(response.url),
+                                encoding=response.encoding,
+                                elapsed=elapsed)
+        else:
+            # Selenium only has the page source
+            self.archive.record(url, self.status_code, source_text or '',
+                                request_headers=request_headers,
+                                final_url=self.url,
+                                elapsed=elapsed)
+
+    def _replay_response(self, url):
+        response = self.archive.get_response(url)
+        if response is None:
+            raise ArchiveMissError("Url not found in archive: {}".format(url), url=url)
+        return response
+
+    def _replay_download(self, url, save_location):
+        """
+        Write the archived file to disk, acting the same as urllib did when it was recorded
+        """
+        response = self._replay_response(url)
+        if response.status_code >= 400:
+            raise urllib.error.HTTPError(url, response.status_code, response.reason, response.headers, None)
 
-        return rdata
+        with open(save_location, 'wb') as out_file:
+            out_file.write(response.content)
+
+    def _replay_site(self, url):
+        """
+        Serve the page from the archive, acting the same as the driver did when it was recorded
+        """
+        response = self._replay_response(url)
+
+        self.status_code = response.status_code
+        self.url = response.url
+        self.response = response
+
+        response.raise_for_status()
+
+        return response.text
 
     def _get_site_status_code(self, url, status_code, api, num_tries, num_apikey_tries):
         """
@@ -326,8 +776,8 @@ class Web:
                         extra={'status_code': status_code,
                                'num_tries': num_tries,
                                'url': url})
-            time.sleep(.5)
-            self.new_profile()
+            self._fire_hook('on_retry', url=url, num_tries=num_tries, reason=status_code, sleep=.5)
+            self._retry_backoff(.5)
             return True
 
         else:
@@ -350,8 +800,11 @@ class Web:
                 logger.error("No parser passed for parsing html")
 
         elif page_format == 'json':
-            if self.driver_type == 'requests':
+            if self.driver_type in ('requests', 'http2'):
                 rdata = json.loads(source)
+            elif self.archive is not None and self.archive.is_replaying:
+                # No browser page to read from, the recorded source has the json wrapped in html
+                rdata = json.loads(self.get_soup(source, input_type='html').get_text())
             else:
                 rdata = json.loads(self.driver.find_element_by_tag_name('body').text)
 
@@ -395,12 +848,23 @@ class Web:
         if url.startswith('//'):
             url = "http:" + url
         try:
-            with urllib.request.urlopen(urllib.request.Request(url, headers=header)) as response,\
-            open(save_location, 'wb') as out_file:
-                data = response.read()
-                out_file.write(data)
+            if self.archive is not None and self.archive.is_replaying:
+                self._replay_download(url, save_location)
+            else:
+                download_start = time.perf_counter()
+                with urllib.request.urlopen(urllib.request.Request(url, headers=header)) as response,\
+                open(save_location, 'wb') as out_file:
+                    data = response.read()
+                    out_file.write(data)
+
+                if self.archive is not None:
+                    self.archive.record(url, response.status, data, headers=response.headers,
+                                        request_headers=header, final_url=response.url,
+                                        elapsed=time.perf_counter() - download_start)
 
         except urllib.error.HTTPError as e:
+            if self.archive is not None and self.archive.is_recording:
+                self.archive.record(url, e.code, b'', headers=e.headers, request_headers=header)
             save_location = None
             # We do not need to show the user 404 errors
             if e.code != 404: